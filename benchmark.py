@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+
+import main
+
+# Генератор синтетических ELF32 RISC-V и замер скорости по этапам работы main.py
+
+TEXT_ADDRESS = 0x10000
+STB_GLOBAL = 1
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHF_ALLOC = 0x2
+EM_RISCV = 243
+
+CASES = {
+    "rv32i": {"rvc": 0.0, "mul": 0.0, "branches": 0.1},
+    "rv32im": {"rvc": 0.0, "mul": 0.3, "branches": 0.1},
+    "rvc": {"rvc": 0.6, "mul": 0.05, "branches": 0.1},
+    "branchy": {"rvc": 0.3, "mul": 0.05, "branches": 0.35},
+}
+SIZES = (64 << 10, 1 << 20)
+STAGES = ("sections", "symtab", "decode", "labels", "output", "symtab_print")
+
+# Поля команд, которые генератор заполняет случайно: (опкод, funct3, funct7 или None)
+BASE_FORMS = [(0b0110011, f3, f7) for (f7, f3) in main.R_OPERATIONS if f7 != 0b0000001] \
+    + [(0b0010011, f3, None) for f3 in main.I_OPERATIONS] \
+    + [(0b0000011, f3, None) for f3 in main.LOAD_OPERATIONS] \
+    + [(0b0100011, f3, None) for f3 in main.S_OPERATIONS] \
+    + [(0b0110111, None, None), (0b0010111, None, None)]
+MUL_FORMS = [(0b0110011, f3, f7) for (f7, f3) in main.R_OPERATIONS if f7 == 0b0000001]
+# Сжатые команды: (квадрант, funct3), кроме переходов
+RVC_FORMS = [(0b00, 0b000), (0b00, 0b010), (0b00, 0b110), (0b01, 0b000), (0b01, 0b010), (0b01, 0b100),
+             (0b10, 0b000), (0b10, 0b010), (0b10, 0b100), (0b10, 0b110)]
+BASE_FORMS_64 = BASE_FORMS + [(0b0111011, f3, f7) for (f7, f3) in main.R64_OPERATIONS if f7 != 0b0000001] \
+    + [(0b0011011, 0b000, None), (0b0000011, 0b011, None), (0b0000011, 0b110, None), (0b0100011, 0b011, None)]
+MUL_FORMS_64 = MUL_FORMS + [(0b0111011, f3, f7) for (f7, f3) in main.R64_OPERATIONS if f7 == 0b0000001]
+RVC_FORMS_64 = RVC_FORMS + list(main.RVC64_HANDLERS)
+
+
+def encode_base(rng: random.Random, form: tuple) -> int:
+    opcode, funct3, funct7 = form
+    word = opcode | rng.getrandbits(5) << 7 | rng.getrandbits(5) << 15 | rng.getrandbits(5) << 20
+    if funct3 is None:
+        return word | rng.getrandbits(8) << 12 | rng.getrandbits(12) << 20
+    word |= funct3 << 12
+    if funct7 is not None:
+        return word | funct7 << 25
+    if opcode == 0b0010011 and funct3 in (0b001, 0b101):
+        return word
+    return word | rng.getrandbits(7) << 25
+
+
+def encode_branch(rng: random.Random, offset: int) -> int:
+    imm = offset & 0x1fff
+    return 0b1100011 | (imm >> 11 & 1) << 7 | (imm >> 1 & 0xf) << 8 | rng.choice(list(main.B_OPERATIONS)) << 12 \
+        | rng.getrandbits(5) << 15 | rng.getrandbits(5) << 20 | (imm >> 5 & 0x3f) << 25 | (imm >> 12 & 1) << 31
+
+
+def encode_jal(rng: random.Random, offset: int) -> int:
+    imm = offset & 0x1fffff
+    return 0b1101111 | rng.getrandbits(5) << 7 | (imm >> 12 & 0xff) << 12 | (imm >> 11 & 1) << 20 \
+        | (imm >> 1 & 0x3ff) << 21 | (imm >> 20 & 1) << 31
+
+
+def encode_rvc(rng: random.Random, forms: list) -> int:
+    quadrant, funct3 = rng.choice(forms)
+    return quadrant | rng.getrandbits(11) << 2 | funct3 << 13
+
+
+def generate_text(rng: random.Random, size: int, rvc: float, mul: float, branches: float, xlen: int = 32) -> bytes:
+    # Сначала выбираются виды и длины команд, затем переходы кодируются на реальные начала команд
+    kinds = []
+    total = 0
+    while total + 4 <= size:
+        if rng.random() < branches:
+            kinds.append("jal" if rng.random() < 0.2 else "branch")
+        elif rng.random() < rvc:
+            kinds.append("rvc")
+        else:
+            kinds.append("mul" if rng.random() < mul else "base")
+        total += 2 if kinds[-1] == "rvc" else 4
+    offsets = []
+    total = 0
+    for kind in kinds:
+        offsets.append(total)
+        total += 2 if kind == "rvc" else 4
+    base_forms, mul_forms, rvc_forms = (BASE_FORMS_64, MUL_FORMS_64, RVC_FORMS_64) if xlen == 64 \
+        else (BASE_FORMS, MUL_FORMS, RVC_FORMS)
+    text = bytearray()
+    for i, kind in enumerate(kinds):
+        if kind == "rvc":
+            text += encode_rvc(rng, rvc_forms).to_bytes(2, "little")
+            continue
+        if kind in ("branch", "jal"):
+            window = 1000 if kind == "branch" else 100000
+            target = offsets[min(max(i + rng.randint(-window // 4, window // 4), 0), len(offsets) - 1)]
+            offset = target - offsets[i]
+            if kind == "branch" and -4096 <= offset < 4096:
+                word = encode_branch(rng, offset)
+            else:
+                word = encode_jal(rng, offset)
+        else:
+            word = encode_base(rng, rng.choice(mul_forms if kind == "mul" else base_forms))
+        text += word.to_bytes(4, "little")
+    return bytes(text)
+
+
+def build_elf(text: bytes, symbols: int, rng: random.Random, elf_class: int = main.ELFCLASS32) -> bytes:
+    header = main.HEADER_STRUCT[elf_class]["<"]
+    section = main.SECTION_STRUCT[elf_class]["<"]
+    symbol = main.SYMBOL_STRUCT[elf_class]["<"]
+    text_offset = header.size
+    starts = main.build_instruction_index(text)[0].tolist()
+    function_starts = sorted(rng.sample(starts[1:], min(max(symbols - 1, 0), len(starts) - 1)))
+    function_starts = ([0] if symbols and starts else []) + function_starts
+    strtab = bytearray(b"\0")
+    symtab = bytearray(symbol.size)
+    for i, start in enumerate(function_starts):
+        end = function_starts[i + 1] if i + 1 < len(function_starts) else len(text)
+        name_offset = len(strtab)
+        strtab += "func_{0}\0".format(i).encode()
+        fields = (name_offset, TEXT_ADDRESS + text_offset + start, end - start, STB_GLOBAL << 4 | main.STT_FUNC, 0, 1)
+        symtab += symbol.pack(*(fields[main.SYMBOL_ORDER[elf_class].index(i)] for i in range(6)))
+    shstrtab = b"\0.text\0.symtab\0.strtab\0.shstrtab\0"
+
+    def align(data: bytearray) -> None:
+        data += b"\0" * (-len(data) % 4)
+
+    image = bytearray(text_offset)
+    image += text
+    align(image)
+    symtab_offset = len(image)
+    image += symtab
+    strtab_offset = len(image)
+    image += strtab
+    shstrtab_offset = len(image)
+    image += shstrtab
+    align(image)
+    section_offset = len(image)
+    image += bytes(section.size)
+    image += section.pack(1, SHT_PROGBITS, SHF_ALLOC | main.SHF_EXECINSTR, TEXT_ADDRESS + text_offset, text_offset,
+                          len(text), 0, 0, 4, 0)
+    image += section.pack(7, SHT_SYMTAB, 0, 0, symtab_offset, len(symtab), 3, 1, 4, symbol.size)
+    image += section.pack(15, SHT_STRTAB, 0, 0, strtab_offset, len(strtab), 0, 0, 1, 0)
+    image += section.pack(23, SHT_STRTAB, 0, 0, shstrtab_offset, len(shstrtab), 0, 0, 1, 0)
+    ident = b"\x7fELF" + bytes([elf_class, 1, 1]) + bytes(9)
+    image[:header.size] = header.pack(ident, 2, EM_RISCV, 1, TEXT_ADDRESS + text_offset, 0, section_offset, 0,
+                                      header.size, 0, 0, section.size, 5, 4)
+    return bytes(image)
+
+
+def generate_elf(size: int, rvc: float = 0.3, mul: float = 0.05, branches: float = 0.1, symbols: int = 100,
+                 seed: int = 0, xlen: int = 32) -> bytes:
+    rng = random.Random(seed)
+    elf_class = main.ELFCLASS64 if xlen == 64 else main.ELFCLASS32
+    return build_elf(generate_text(rng, size, rvc, mul, branches, xlen), symbols, rng, elf_class)
+
+
+def run_stages(data: bytes) -> tuple:
+    # Тот же путь, что последовательный disassemble(): ElfFile и listing_lines в ListingWriter,
+    # время этапов берётся из RunStats; возвращает (число команд, время этапов)
+    main.cached_parse4BitCMD.cache_clear()
+    main.cached_parse2BitCMD.cache_clear()
+    stats = main.RunStats()
+    elf = main.ElfFile(data, stats=stats)
+    with open(os.devnull, "w", buffering=main.OUTPUT_BUFFER_SIZE) as out:
+        main.ListingWriter(out).write_lines(elf.listing_lines())
+    return stats.counters.get("instructions", 0), {stage: stats.stages.get(stage, 0.0) for stage in STAGES}
+
+
+def measure(data: bytes, repeat: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        count, times = run_stages(data)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+    tracemalloc.start()
+    run_stages(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(best.values())
+    return {"instructions": count, "stages": best, "total": total, "instructions_per_sec": count / total,
+            "peak_kib": peak // 1024}
+
+
+def run_suite(sizes, cases, symbols: int, repeat: int) -> dict:
+    results = []
+    for size in sizes:
+        for name in cases:
+            data = generate_elf(size, symbols=symbols, **CASES[name])
+            result = measure(data, repeat)
+            result.update({"case": name, "size": size, "elf_size": len(data)})
+            results.append(result)
+            print_result(result)
+    return {"tool_version": main.tool_version().hex()[:16], "python": platform.python_version(),
+            "numpy": main.np is not None, "symbols": symbols, "results": results}
+
+
+def print_result(result: dict) -> None:
+    stages = " ".join("{0}={1:.4f}".format(stage, result["stages"][stage]) for stage in STAGES)
+    print("{0:<8} {1:>9} {2:>8} instr {3:>12,.0f} instr/s {4:>8} KiB  {5}".format(
+        result["case"], result["size"], result["instructions"], result["instructions_per_sec"], result["peak_kib"],
+        stages))
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> int:
+    # Сравнение с сохранённым прогоном: замедление больше threshold по любому этапу или в сумме - регрессия
+    previous = {(result["case"], result["size"]): result for result in baseline["results"]}
+    regressions = 0
+    for result in report["results"]:
+        old = previous.get((result["case"], result["size"]))
+        if old is None:
+            continue
+        for stage in STAGES + ("total",):
+            new_time = result["total"] if stage == "total" else result["stages"][stage]
+            old_time = old["total"] if stage == "total" else old["stages"][stage]
+            if old_time > 0 and new_time / old_time > 1 + threshold:
+                regressions += 1
+                print("REGRESSION {0} {1} {2}: {3:.4f}s -> {4:.4f}s ({5:+.0%})".format(
+                    result["case"], result["size"], stage, old_time, new_time, new_time / old_time - 1))
+    print("{0} regressions against {1}".format(regressions, baseline["tool_version"]))
+    return regressions
+
+
+def check_parallel(size: int, jobs: int, seed: int) -> int:
+    # Листинг с --jobs должен совпадать с последовательным; секция больше LISTING_WINDOW режется на куски.
+    # По умолчанию размер подобран так, чтобы окно на кусок было нечётным и main.py пришлось его выравнивать;
+    # без сжатых команд нечётная граница куска приходится внутрь команды
+    if size is None:
+        chunks = jobs * main.PARALLEL_CHUNKS_PER_JOB
+        size = chunks * ((main.LISTING_WINDOW // chunks + 1) | 1)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ("check.elf", "serial.txt", "parallel.txt")]
+        with open(paths[0], "wb") as f:
+            f.write(generate_elf(size, seed=seed, **CASES["rv32i"]))
+        main.disassemble(paths[0], paths[1])
+        main.disassemble(paths[0], paths[2], jobs=jobs)
+        with open(paths[1]) as serial, open(paths[2]) as parallel:
+            for number, (expected, actual) in enumerate(zip(serial, parallel), 1):
+                if expected != actual:
+                    print("MISMATCH line {0}:\n  serial:   {1}  --jobs {2}: {3}".format(
+                        number, expected, jobs, actual), end="")
+                    return 1
+            if serial.read(1) or parallel.read(1):
+                print("MISMATCH: listings differ in length")
+                return 1
+    print("--jobs {0} matches the serial listing ({1} bytes of .text)".format(jobs, size))
+    return 0
+
+
+def main_benchmark() -> None:
+    arg_parser = argparse.ArgumentParser(description="Synthetic RV32IMC ELF generator and benchmark for main.py")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write one synthetic ELF file")
+    generate.add_argument("output", help="output ELF file")
+    generate.add_argument("--size", type=int, default=1 << 20, help=".text size in bytes")
+    generate.add_argument("--rvc", type=float, default=0.3, help="share of compressed commands")
+    generate.add_argument("--mul", type=float, default=0.05, help="share of RV32M commands among 32-bit ones")
+    generate.add_argument("--branches", type=float, default=0.1, help="share of branches and jumps")
+    generate.add_argument("--symbols", type=int, default=100, help="number of FUNC symbols")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--rv64", action="store_true", help="write an ELF64 file with RV64 commands")
+
+    run = commands.add_parser("run", help="time every stage on generated files")
+    run.add_argument("--sizes", type=int, nargs="+", default=SIZES, help=".text sizes in bytes")
+    run.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES), help="instruction mixes")
+    run.add_argument("--symbols", type=int, default=1000, help="number of FUNC symbols")
+    run.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    run.add_argument("--save", metavar="FILE", help="save results as JSON")
+    run.add_argument("--compare", metavar="FILE", help="compare with results saved earlier")
+    run.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before a regression is reported")
+
+    check = commands.add_parser("check", help="compare the --jobs listing with the serial one")
+    check.add_argument("--size", type=int, help=".text size in bytes, larger than one listing window")
+    check.add_argument("--jobs", type=int, default=4)
+    check.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    if args.command == "generate":
+        with open(args.output, "wb") as f:
+            f.write(generate_elf(args.size, args.rvc, args.mul, args.branches, args.symbols, args.seed,
+                                 64 if args.rv64 else 32))
+        return
+    if args.command == "check":
+        sys.exit(check_parallel(args.size, args.jobs, args.seed))
+
+    report = run_suite(args.sizes, args.cases, args.symbols, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -1,7 +1,73 @@
-from typing import List
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
+from time import perf_counter
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import locale
+import marshal
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import struct
 import sys
 
-SECTION = 40
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DECODE_CACHE_SIZE = 1 << 16
+RVC_TABLE_MAGIC = b"RVCT"
+RVC_TABLE_VERSION = 2
+RVC_TABLE_NO_TARGET = -(1 << 31)
+OUTPUT_BUFFER_SIZE = 1 << 20
+OUTPUT_BATCH_LINES = 4096
+IN_MEMORY_BUFFER_LIMIT = 64 << 20
+PARALLEL_CHUNKS_PER_JOB = 4
+PARALLEL_MIN_CHUNK = 1 << 16
+LISTING_WINDOW = 1 << 22
+INSTRUCTION_STREAM_WINDOW = 1 << 12
+TARGET_SEPARATOR = ", "
+BATCH_CHUNK_SIZE = 8
+LISTING_CACHE_SIZE = 256 << 20
+LISTING_CACHE_TRIM = 0.9
+COLUMNAR_MAGIC = b"RVCL"
+COLUMNAR_VERSION = 2
+COLUMNAR_NO_TARGET = -(1 << 31)
+COLUMNAR_NO_REGISTER = 0xff
+OUTPUT_EXTENSIONS = {"text": ".txt", "columnar": ".rvcl"}
+CACHE_EXTENSIONS = {**OUTPUT_EXTENSIONS, "state": ".state"}
+INCREMENTAL_MAGIC = b"RVIS"
+INCREMENTAL_VERSION = 2
+INCREMENTAL_CHUNK = 1 << 12
+SYMBOLIZER_SORT_MIN = 1 << 15
+RVC_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rvc_table.bin")
+LISTING_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "listing_cache")
+
+ELF_BYTE_ORDERS = {
+    1: "<",
+    2: ">"
+}
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+# Разрядность команд по классу ELF
+ELF_XLEN = {
+    ELFCLASS32: 32,
+    ELFCLASS64: 64
+}
+
+STT_OBJECT = 1
+STT_FUNC = 2
+SHT_NOBITS = 8
+SHF_EXECINSTR = 0x4
 
 SYMBOL_TYPES = {
     0: "NOTYPE",
@@ -96,801 +162,2826 @@ REGS_CSR = {
     0xc81: "timeh",
     0xc82: "instreth"
 }
+R_OPERATIONS = {
+    (0b0000000, 0b000): "add",
+    (0b0000000, 0b001): "sll",
+    (0b0000000, 0b010): "slt",
+    (0b0000000, 0b100): "xor",
+    (0b0000000, 0b101): "srl",
+    (0b0000000, 0b110): "or",
+    (0b0000000, 0b111): "and",
+    (0b0000001, 0b000): "mul",
+    (0b0000001, 0b001): "mulh",
+    (0b0000001, 0b011): "mulhu",
+    (0b0000001, 0b101): "divu",
+    (0b0000001, 0b110): "rem",
+    (0b0000001, 0b111): "remu",
+    (0b0100000, 0b000): "sub",
+    (0b0100000, 0b101): "sra"
+}
+I_OPERATIONS = {
+    0b000: "addi",
+    0b010: "slti",
+    0b011: "SLTIU",
+    0b100: "xori",
+    0b110: "ori",
+    0b111: "andi"
+}
+LOAD_OPERATIONS = {
+    0b000: "lb",
+    0b001: "lh",
+    0b010: "lw",
+    0b100: "lbu",
+    0b101: "lhu"
+}
+S_OPERATIONS = {
+    0b000: "sb",
+    0b001: "sh",
+    0b010: "sw"
+}
+B_OPERATIONS = {
+    0b000: "beq",
+    0b001: "bne",
+    0b100: "blt",
+    0b101: "bqe",
+    0b110: "bltu",
+    0b111: "bgeu"
+}
+CSR_OPERATIONS = {
+    0b001: "CSRRW",
+    0b010: "CSRRS",
+    0b011: "CSRRC",
+    0b101: "CSRRWI",
+    0b110: "CSRRSI",
+    0b111: "CSRRCI"
+}
+C_ARITH_OPERATIONS = {
+    0b00: "c.sub",
+    0b01: "c.xor",
+    0b10: "c.or",
+    0b11: "c.and"
+}
+# RV64: операции над 32-битными словами (OP-32) и 64-битные загрузки/сохранения
+R64_OPERATIONS = {
+    (0b0000000, 0b000): "addw",
+    (0b0100000, 0b000): "subw",
+    (0b0000000, 0b001): "sllw",
+    (0b0000000, 0b101): "srlw",
+    (0b0100000, 0b101): "sraw",
+    (0b0000001, 0b000): "mulw",
+    (0b0000001, 0b100): "divw",
+    (0b0000001, 0b101): "divuw",
+    (0b0000001, 0b110): "remw",
+    (0b0000001, 0b111): "remuw"
+}
+LOAD64_OPERATIONS = {**LOAD_OPERATIONS, 0b011: "ld", 0b110: "lwu"}
+S64_OPERATIONS = {**S_OPERATIONS, 0b011: "sd"}
+C_ARITH64_OPERATIONS = {
+    0b00: "c.subw",
+    0b01: "c.addw"
+}
+MNEMONICS = ("unknown_command",) + tuple(R_OPERATIONS.values()) + ("slli", "srli", "srai") \
+    + tuple(I_OPERATIONS.values()) + tuple(LOAD_OPERATIONS.values()) + tuple(S_OPERATIONS.values()) \
+    + tuple(B_OPERATIONS.values()) + ("lui", "jal", "jalr", "auipc", "ecall", "ebreak") \
+    + tuple(CSR_OPERATIONS.values()) \
+    + ("c.addi4spn", "c.lw", "c.sw", "c.addi", "c.jal", "c.li", "c.addi16sp", "c.lui", "c.srli", "c.srai", "c.andi") \
+    + tuple(C_ARITH_OPERATIONS.values()) \
+    + ("c.j", "c.beqz", "c.bnez", "c.slli", "c.lwsp", "c.jr", "c.mv", "c.ebreak", "c.jalr", "c.add", "c.swsp") \
+    + ("c.sdsp",) + tuple(R64_OPERATIONS.values()) + ("addiw", "slliw", "srliw", "sraiw", "ld", "lwu", "sd") \
+    + ("c.ld", "c.sd", "c.addiw", "c.ldsp") + tuple(C_ARITH64_OPERATIONS.values())
+MNEMONIC_IDS = {mnemonic: i for i, mnemonic in enumerate(MNEMONICS)}
+
+
+def elf_structs(fmt: str) -> dict:
+    return {order: struct.Struct(order + fmt) for order in ELF_BYTE_ORDERS.values()}
+
+
+HEADER_STRUCT = {
+    ELFCLASS32: elf_structs("16sHHIIIIIHHHHHH"),
+    ELFCLASS64: elf_structs("16sHHIQQQIHHHHHH")
+}
+SECTION_STRUCT = {
+    ELFCLASS32: elf_structs("10I"),
+    ELFCLASS64: elf_structs("IIQQQQIIQQ")
+}
+# В ELF64 st_info, st_other и st_shndx стоят перед st_value и st_size.
+# SYMBOL_ORDER - индексы полей в порядке ELF32 (st_name, st_value, st_size, st_info, st_other, st_shndx)
+SYMBOL_STRUCT = {
+    ELFCLASS32: elf_structs("IIIBBH"),
+    ELFCLASS64: elf_structs("IBBHQQ")
+}
+SYMBOL_ORDER = {
+    ELFCLASS32: (0, 1, 2, 3, 4, 5),
+    ELFCLASS64: (0, 4, 5, 1, 2, 3)
+}
+
+if np is not None:
+    SYMBOL_DTYPE = {
+        ELFCLASS32: {
+            order: np.dtype([("st_name", order + "u4"), ("st_value", order + "u4"), ("st_size", order + "u4"),
+                             ("st_info", "u1"), ("st_other", "u1"), ("st_shndx", order + "u2")])
+            for order in ELF_BYTE_ORDERS.values()
+        },
+        ELFCLASS64: {
+            order: np.dtype([("st_name", order + "u4"), ("st_info", "u1"), ("st_other", "u1"),
+                             ("st_shndx", order + "u2"), ("st_value", order + "u8"), ("st_size", order + "u8")])
+            for order in ELF_BYTE_ORDERS.values()
+        }
+    }
 
 
-def get_bytes(start, length, cc=10):
-    res = 0
-    for i in range(start + length - 1, start - 1, -1):
-        res <<= 8
-        res += stream[i]
+def elf_layout(data) -> tuple:
+    # (порядок байт, класс) по e_ident; неизвестные значения читаются как ELF32 little-endian
+    return ELF_BYTE_ORDERS.get(data[5], "<"), data[4] if data[4] in ELF_XLEN else ELFCLASS32
+
+
+def get_bytes(data, start, length, cc=10):
+    res = int.from_bytes(data[start:start + length], "little" if elf_layout(data)[0] == "<" else "big")
     if cc == 16:
         return hex(res)
     return res
 
 
 class Header:
-    counter = 0
 
-    def __init__(self) -> None:
+    def __init__(self, data) -> None:
         self.e_ident = {
-            "EI_MAG0": get_bytes(self.counter, 3),
-            "EI_CLASS": get_bytes(self.counter + 4, 1),
-            "EI_DATA": get_bytes(self.counter + 5, 1),
-            "EI_VERSION": get_bytes(self.counter + 6, 1),
-            "EI_OSABI": get_bytes(self.counter + 7, 1),
-            "EI_ABIVERSION": get_bytes(self.counter + 8, 1),
-            "EI_PAD": get_bytes(self.counter + 9, 1)
+            "EI_MAG0": get_bytes(data, 0, 3),
+            "EI_CLASS": data[4],
+            "EI_DATA": data[5],
+            "EI_VERSION": data[6],
+            "EI_OSABI": data[7],
+            "EI_ABIVERSION": data[8],
+            "EI_PAD": data[9]
         }
-        self.counter += 28
-        self.e_phoff = get_bytes(28, 4)
-        self.e_shoff = get_bytes(32, 4)
-        self.e_shnum = get_bytes(48, 2)
-        self.e_shstrndx = get_bytes(50, 2)
+        self.byte_order, self.elf_class = elf_layout(data)
+        (_, self.e_type, self.e_machine, self.e_version, self.e_entry, self.e_phoff, self.e_shoff, self.e_flags,
+         self.e_ehsize, self.e_phentsize, self.e_phnum, self.e_shentsize, self.e_shnum,
+         self.e_shstrndx) = HEADER_STRUCT[self.elf_class][self.byte_order].unpack_from(data, 0)
 
 
 class Section:
-    start = 0
-
-    def __init__(self, start) -> None:
-        self.sh_name = get_bytes(start, 4)
-        self.sh_type = get_bytes(start + 4, 4)
-        self.sh_flags = get_bytes(start + 8, 4)
-        self.sh_addr = get_bytes(start + 12, 4)
-        self.sh_offset = get_bytes(start + 16, 4)
-        self.sh_size = get_bytes(start + 20, 4)
-        self.sh_link = get_bytes(start + 24, 4)
-        self.sh_info = get_bytes(start + 28, 4)
-        self.sh_addralign = get_bytes(start + 32, 4)
-        self.sh_entsize = get_bytes(start + 36, 4)
-
-
-class SymbolTable:
-
-    def __init__(self, start) -> None:
-        self.st_name = get_bytes(start, 4)
-        self.st_value = get_bytes(start + 4, 4)
-        self.st_size = get_bytes(start + 8, 4)
-        self.st_info = get_bytes(start + 12, 1)
-        self.st_other = get_bytes(start + 13, 1)
-        self.st_shndx = get_bytes(start + 14, 2)
-        self.st_bind = self.st_info >> 4
-        self.st_type = self.st_info & 15
-        self.st_vis = self.st_other & 3
-
-if len(sys.argv)<3:
-    print("Count of args must be 3 or higher")
-    exit(403)
 
-try:
-    f = open(sys.argv[1], "rb")
-    stream = f.read()
-    f.close()
-except Exception:
-    print("Error while working with input file.")
-    print("Interrupring")
-    exit(404)
+    def __init__(self, fields: tuple) -> None:
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset, self.sh_size, self.sh_link,
+         self.sh_info, self.sh_addralign, self.sh_entsize) = fields
+        self.name = ""
 
-try:
-    head = Header()
-    sections = []
-    sym_table_rows = []
-    code_arr = []
-    labels = {}
 
+class StringTable:
+    # Таблица строк секции: секция не копируется, имена вырезаются из файла по запросу,
+    # декодируются один раз и кэшируются по смещению
 
-    def parse_sections(header: Header, sections: object) -> None:
-        for i in range(header.e_shnum):
-            sections.append(Section(head.e_shoff + 40 * i))
+    def __init__(self, data, section: Section) -> None:
+        # Конец строки ищется find по исходному буферу (mmap или bytes) - у memoryview его нет
+        source = data.obj if isinstance(data, memoryview) else data
+        if hasattr(source, "find") and len(source) == len(data):
+            self.data, self.start = source, section.sh_offset
+        else:
+            self.data, self.start = bytes(data[section.sh_offset:section.sh_offset + section.sh_size]), 0
+        self.end = min(self.start + section.sh_size, len(self.data))
+        self.names = {}
+
+    def get(self, offset: int) -> str:
+        name = self.names.get(offset)
+        if name is None:
+            start = self.start + offset
+            end = self.data.find(b"\0", start, self.end)
+            if end < 0:
+                end = self.end
+            name = sys.intern(self.data[start:end].decode("latin-1"))
+            self.names[offset] = name
+        return name
+
+
+class SectionIndex:
+    # Индексы секций по имени и по типу, строятся один раз при разборе заголовков
+
+    def __init__(self, sections: list, names: StringTable) -> None:
+        self.by_name = {}
+        self.by_type = {}
+        self.executable = []
+        for section in sections:
+            section.name = names.get(section.sh_name)
+            self.by_name.setdefault(section.name, section)
+            self.by_type.setdefault(section.sh_type, []).append(section)
+            if section.sh_flags & SHF_EXECINSTR:
+                self.executable.append(section)
+
+    def get(self, name: str) -> Section:
+        section = self.by_name.get(name)
+        if section is None:
+            raise ValueError("Section {0} not found".format(name))
+        return section
+
+    def of_type(self, sh_type: int) -> list:
+        return self.by_type.get(sh_type, [])
+
+    def code(self) -> list:
+        # Исполняемые секции с содержимым в файле по возрастанию адреса; если их нет - .text, как раньше
+        sections = [section for section in self.executable if section.sh_type != SHT_NOBITS and section.sh_size]
+        if not sections:
+            return [self.get(".text")]
+        return sorted(sections, key=lambda section: (section.sh_addr, section.sh_offset))
+
+
+class SymbolTableColumns:
+    # Вся таблица .symtab, разобранная за один проход: по колонке на каждое поле
+
+    def __init__(self, data, symtab: Section, byte_order: str, elf_class: int) -> None:
+        self.entsize = SYMBOL_STRUCT[elf_class][byte_order].size
+        self.count = symtab.sh_size // self.entsize
+        if np is not None:
+            rows = np.frombuffer(data, dtype=SYMBOL_DTYPE[elf_class][byte_order], count=self.count,
+                                 offset=symtab.sh_offset)
+            self.st_name = rows["st_name"]
+            self.st_value = rows["st_value"]
+            self.st_size = rows["st_size"]
+            self.st_info = rows["st_info"]
+            self.st_other = rows["st_other"]
+            self.st_shndx = rows["st_shndx"]
+        else:
+            rows = SYMBOL_STRUCT[elf_class][byte_order].iter_unpack(
+                data[symtab.sh_offset:symtab.sh_offset + self.entsize * self.count])
+            columns = list(zip(*rows)) if self.count else [()] * 6
+            (self.st_name, self.st_value, self.st_size, self.st_info, self.st_other,
+             self.st_shndx) = (array("Q", columns[i]) for i in SYMBOL_ORDER[elf_class])
+        self.st_bind = self.st_info >> 4 if np is not None else array("B", (info >> 4 for info in self.st_info))
+        self.st_type = self.st_info & 15 if np is not None else array("B", (info & 15 for info in self.st_info))
+        self.st_vis = self.st_other & 3 if np is not None else array("B", (other & 3 for other in self.st_other))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def indices_of_type(self, st_type: int) -> list:
+        if np is not None:
+            return np.flatnonzero(self.st_type == st_type).tolist()
+        return [i for i, row_type in enumerate(self.st_type) if row_type == st_type]
+
+
+def parse_sections(data, header: Header, sections: object, string_tables: dict) -> SectionIndex:
+    section_struct = SECTION_STRUCT[header.elf_class][header.byte_order]
+    table = data[header.e_shoff:header.e_shoff + section_struct.size * header.e_shnum]
+    for fields in section_struct.iter_unpack(table):
+        sections.append(Section(fields))
+    return SectionIndex(sections, get_string_table(data, sections[header.e_shstrndx], string_tables))
+
+
+def get_string_table(data, section: Section, string_tables: dict) -> StringTable:
+    # string_tables - кэш таблиц строк одного файла по смещению секции
+    table = string_tables.get(section.sh_offset)
+    if table is None:
+        table = string_tables[section.sh_offset] = StringTable(data, section)
+    return table
+
+
+# Строка .symtab: номер, значение, размер, тип, связывание, видимость, индекс секции, имя
+SYMTAB_ROW_FORMAT = "[%4d] %-#17x %5d %-8s %-8s %-8s %6s %s\n"
+
+
+def take(column, indices):
+    if np is not None:
+        return np.asarray(column)[indices]
+    return array(column.typecode, (column[i] for i in indices))
+
+
+def column_labels(column, lookup) -> list:
+    # Подписи значений колонки: lookup вызывается один раз на каждое различное значение
+    if np is not None:
+        values, inverse = np.unique(np.asarray(column), return_inverse=True)
+        labels = np.empty(len(values), dtype=object)
+        labels[:] = [lookup(value) for value in values.tolist()]
+        return labels[inverse].tolist()
+    cache = {}
+    return [cache[value] if value in cache else cache.setdefault(value, lookup(value)) for value in column]
+
+
+def format_symbol_table(symbols: "SymbolTableColumns", str_table: StringTable, indices=None) -> list:
+    # Текст строк .symtab с номерами indices (по умолчанию - всех) по SYMTAB_ROW_FORMAT,
+    # собирается по колонкам: имена, типы и индексы секций переводятся в текст по различным значениям,
+    # а строки форматируются пачками по OUTPUT_BATCH_LINES одной операцией % на пачку
+    if indices is None:
+        indices = np.arange(len(symbols)) if np is not None else range(len(symbols))
+    columns = [take(getattr(symbols, name), indices) for name in
+               ("st_value", "st_size", "st_type", "st_bind", "st_vis", "st_shndx", "st_name")]
+    rows = zip(indices.tolist() if np is not None else indices, columns[0].tolist(), columns[1].tolist(),
+               column_labels(columns[2], lambda value: SYMBOL_TYPES.get(value, value)),
+               column_labels(columns[3], lambda value: BIND_TYPES.get(value, value)),
+               column_labels(columns[4], lambda value: SYMBOL_VIS.get(value, value)),
+               column_labels(columns[5], lambda value: SYMBOL_IND.get(value, value)),
+               column_labels(columns[6], str_table.get))
+    texts = []
+    while True:
+        batch = tuple(chain.from_iterable(islice(rows, OUTPUT_BATCH_LINES)))
+        if not batch:
+            break
+        texts.append(SYMTAB_ROW_FORMAT * (len(batch) // 8) % batch)
+    return texts
+
+
+class SymbolQuery:
+    # Отбор и порядок строк .symtab в выводе. Фильтры и сортировка считаются по колонкам,
+    # имена проверяются по одному разу на каждое различное имя
+
+    def __init__(self, types: tuple = None, binds: tuple = None, sections: tuple = None, prefix: str = None,
+                 regex: str = None, sort: str = None) -> None:
+        self.types = types
+        self.binds = binds
+        self.sections = sections
+        self.prefix = prefix
+        self.regex = re.compile(regex) if regex is not None else None
+        self.sort = sort
+
+    def key(self) -> str:
+        return repr((self.types, self.binds, self.sections, self.prefix,
+                     self.regex.pattern if self.regex is not None else None, self.sort))
+
+    def match_name(self, name: str) -> bool:
+        return (self.prefix is None or name.startswith(self.prefix)) \
+            and (self.regex is None or self.regex.search(name) is not None)
+
+    def select(self, symbols: "SymbolTableColumns", str_table: StringTable):
+        # Номера подходящих строк в порядке вывода
+        filters = [(symbols.st_type, self.types), (symbols.st_bind, self.binds), (symbols.st_shndx, self.sections)]
+        by_name = self.prefix is not None or self.regex is not None
+        if np is None:
+            names = {}
+            for name in set(symbols.st_name) if by_name else ():
+                names[name] = self.match_name(str_table.get(name))
+            indices = [i for i in range(len(symbols))
+                       if all(values is None or column[i] in values for column, values in filters)
+                       and (not by_name or names[symbols.st_name[i]])]
+            if self.sort == "name":
+                indices.sort(key=lambda i: str_table.get(symbols.st_name[i]))
+            elif self.sort is not None:
+                column = getattr(symbols, "st_" + self.sort)
+                indices.sort(key=column.__getitem__)
+            return indices
+        mask = np.ones(len(symbols), dtype=bool)
+        for column, values in filters:
+            if values is not None:
+                mask &= np.isin(column, values)
+        if by_name:
+            names, inverse = np.unique(symbols.st_name, return_inverse=True)
+            matched = np.array([self.match_name(str_table.get(name)) for name in names.tolist()], dtype=bool)
+            mask &= matched[inverse]
+        indices = np.flatnonzero(mask)
+        if self.sort == "name":
+            # Сортировка по рангу имени среди различных имён отобранных строк
+            names, inverse = np.unique(symbols.st_name[indices], return_inverse=True)
+            strings = [str_table.get(name) for name in names.tolist()]
+            ranks = np.empty(len(names), dtype=np.int64)
+            ranks[sorted(range(len(names)), key=strings.__getitem__)] = np.arange(len(names))
+            indices = indices[np.argsort(ranks[inverse], kind="stable")]
+        elif self.sort is not None:
+            indices = indices[np.argsort(getattr(symbols, "st_" + self.sort)[indices], kind="stable")]
+        return indices
+
+
+def getSectionByName(index: SectionIndex, name: str) -> Section:
+    return index.get(name)
+
+
+def parse_symbol_table_rows(data, symtab: Section, byte_order: str, elf_class: int) -> SymbolTableColumns:
+    return SymbolTableColumns(data, symtab, byte_order, elf_class)
+
+
+def is_32bit(first_byte):
+    # Длина команды определяется двумя младшими битами первого полуслова: 0b11 - 32 бита, иначе 16.
+    # Принимает число (первый байт или полуслово) или массив numpy таких чисел
+    return (first_byte & 0b11) == 0b11
+
+
+def build_instruction_index(code_bytes: bytes):
+    # Смещения начал команд относительно начала секции и их длины по правилу is_32bit.
+    # Единственный разбор кода на команды: все режимы вывода получают его через code_windows/ElfFile.windows
+    count = len(code_bytes) // 2
+    if np is not None:
+        halfwords = np.frombuffer(code_bytes, dtype="<u2", count=count)
+        is32 = is_32bit(halfwords)
+        # Полуслово после 16-битного всегда начинает команду; от такой опоры
+        # внутри серии 32-битных полуслов начала команд идут через одно.
+        anchors = np.ones(count, dtype=bool)
+        anchors[1:] = ~is32[:-1]
+        positions = np.arange(count)
+        anchor_positions = np.maximum.accumulate(np.where(anchors, positions, 0))
+        starts = np.flatnonzero(((positions - anchor_positions) & 1) == 0)
+        sizes = np.where(is32[starts], 4, 2)
+        offsets = starts * 2
+    else:
+        offsets = array("I")
+        sizes = array("B")
+        i = 0
+        while i < count * 2:
+            offsets.append(i)
+            sizes.append(4 if is_32bit(code_bytes[i]) else 2)
+            i += sizes[-1]
+    if len(offsets) and offsets[-1] + sizes[-1] > len(code_bytes):
+        # Обрезанная 32-битная команда в конце секции
+        sizes[-1] = 2
+    return offsets, sizes
+
+
+def code_windows(code_bytes: bytes, window: int = LISTING_WINDOW):
+    # Секция по окнам не больше window байт, чтобы индекс и записи не зависели от размера всей секции.
+    # Длины команд определяются подряд от начала, поэтому окно обрезается перед последней неполной командой,
+    # а следующее начинается с неё. Выдаёт (начало окна, конец окна, смещения, длины) - смещения от начала окна.
+    # Окно чётное (команды начинаются на границе полуслова) и не меньше одной 32-битной команды.
+    window = max(window & ~1, 4)
+    begin = 0
+    size = len(code_bytes)
+    while True:
+        end = min(begin + window, size)
+        offsets, sizes = build_instruction_index(code_bytes[begin:end])
+        if end < size and len(offsets) and is_32bit(code_bytes[begin + offsets[-1]]) \
+                and offsets[-1] + 4 > end - begin:
+            end = begin + int(offsets[-1])
+            offsets, sizes = offsets[:-1], sizes[:-1]
+        yield begin, end, offsets, sizes
+        if end >= size:
+            break
+        begin = end
+
+
+def instruction_words(code_bytes: bytes, offsets, sizes):
+    # Сырые слова команд: для 16-битных - одно полуслово, для 32-битных - два
+    if np is not None:
+        halfwords = np.frombuffer(code_bytes, dtype="<u2", count=len(code_bytes) // 2).astype(np.uint32)
+        starts = np.asarray(offsets) // 2
+        words = halfwords[starts]
+        is32 = np.asarray(sizes) == 4
+        words[is32] |= halfwords[starts[is32] + 1] << 16
+        return words
+    return array("I", (int.from_bytes(code_bytes[offset:offset + size], "little")
+                       for offset, size in zip(offsets, sizes)))
+
+
+def batch_sign_extend(values, bits: int):
+    sign = 1 << (bits - 1)
+    return (values & (sign - 1)) - (values & sign)
+
+
+def batch_fields(words) -> dict:
+    # Поля 32-битного формата для всех команд секции сразу
+    words = np.asarray(words, dtype=np.int64)
+    return {
+        "opcode": words & 0b1111111,
+        "rd": (words >> 7) & 0b11111,
+        "funct3": (words >> 12) & 0b111,
+        "rs1": (words >> 15) & 0b11111,
+        "rs2": (words >> 20) & 0b11111,
+        "funct7": (words >> 25) & 0b1111111,
+    }
+
+
+def batch_jump_offsets(words, sizes, xlen: int = 32):
+    # Смещения целей переходов тех же команд, что дают метку в parseB, parseJal,
+    # parseJAL2, parseJ2 и parseBEQZBNEZ; для остальных команд маска False.
+    # В RV64 на месте c.jal стоит c.addiw.
+    words = np.asarray(words, dtype=np.int64)
+    fields = batch_fields(words)
+    is32 = np.asarray(sizes) == 4
+    opcode, funct3 = fields["opcode"], fields["funct3"]
+    offsets = np.zeros(len(words), dtype=np.int64)
+    mask = np.zeros(len(words), dtype=bool)
+
+    branch = is32 & (opcode == 0b1100011) & (funct3 != 0b010) & (funct3 != 0b011)
+    imm = (((words >> 31) & 0b1) << 12) | (((words >> 7) & 0b1) << 11) | (((words >> 25) & 0b111111) << 5) \
+        | (((words >> 8) & 0b1111) << 1)
+    offsets[branch] = batch_sign_extend(imm[branch], 13)
+    mask |= branch
+
+    jal = is32 & (opcode == 0b1101111)
+    imm = (((words >> 31) & 0b1) << 19) | (((words >> 13) & 0b1111111) << 12) | (((words >> 20) & 0b1) << 11) \
+        | (((words >> 21) & 0b1111111111) << 1)
+    offsets[jal] = batch_sign_extend(imm[jal], 20)
+    mask |= jal
+
+    quadrant1 = ~is32 & ((words & 0b11) == 0b01)
+    cfunct3 = (words >> 13) & 0b111
+    imm = (((words >> 12) & 0b1) << 11) | (((words >> 8) & 0b1) << 10) | (((words >> 9) & 0b11) << 8) \
+        | (((words >> 6) & 0b1) << 7) | (((words >> 7) & 0b1) << 6) | (((words >> 2) & 0b1) << 5) \
+        | (((words >> 11) & 0b1) << 4) | (((words >> 3) & 0b111) << 1)
+    c_jal = quadrant1 & (cfunct3 == 0b001) & (xlen == 32)
+    offsets[c_jal] = imm[c_jal]
+    c_j = quadrant1 & (cfunct3 == 0b101)
+    offsets[c_j] = batch_sign_extend(imm[c_j], 12)
+    mask |= c_jal | c_j
+
+    c_branch = quadrant1 & (cfunct3 >= 0b110)
+    imm = (((words >> 12) & 0b1) << 8) | (((words >> 5) & 0b11) << 6) | (((words >> 2) & 0b1) << 5) \
+        | (((words >> 10) & 0b11) << 3) | (((words >> 3) & 0b11) << 1)
+    offsets[c_branch] = batch_sign_extend(imm[c_branch], 9)
+    mask |= c_branch
+    return offsets, mask
+
+
+def batch_label_targets(words, sizes, addresses, xlen: int = 32):
+    # Адреса всех меток переходов в порядке первого появления
+    offsets, mask = batch_jump_offsets(words, sizes, xlen)
+    targets = np.asarray(addresses, dtype=np.int64)[mask] + offsets[mask]
+    _, first = np.unique(targets, return_index=True)
+    return targets[np.sort(first)]
+
+
+def sign_extend(value: int, bits: int) -> int:
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+
+def compressed_imm6(cmd: int) -> int:
+    # imm[5] = cmd[12], imm[4:0] = cmd[6:2]
+    return (((cmd >> 12) & 0b1) << 5) | ((cmd >> 2) & 0b11111)
+
+
+def compressed_jump_offset(cmd: int) -> int:
+    # CJ-формат: offset[11|4|9:8|10|6|7|3:1|5] = cmd[12:2]
+    return (((cmd >> 12) & 0b1) << 11) | (((cmd >> 8) & 0b1) << 10) | (((cmd >> 9) & 0b11) << 8) \
+        | (((cmd >> 6) & 0b1) << 7) | (((cmd >> 7) & 0b1) << 6) | (((cmd >> 2) & 0b1) << 5) \
+        | (((cmd >> 11) & 0b1) << 4) | (((cmd >> 3) & 0b111) << 1)
+
+
+class LabelsFormated:
+    def __init__(self, symtab_rows: SymbolTableColumns, str_row_table: StringTable) -> None:
+        self.labels_human = {}
+        self.named = {}
+        self.unnamed = set()
+        self.unnamed_counter = 0
+        self.maxLen = 9
+        # Отсортированный индекс меток для поиска ближайшей предшествующей через bisect
+        self.addresses = []
+        self.named_addresses = []
+        self.indexed = False
+        self.parse_labels_symtab(symtab_rows, str_row_table)
+
+    def __getstate__(self) -> dict:
+        # Производные индексы не передаются воркерам, они перестраиваются при первом обращении
+        return {"named": self.named, "unnamed": self.unnamed, "maxLen": self.maxLen}
+
+    def __setstate__(self, state: dict) -> None:
+        self.named = state["named"]
+        self.unnamed = state["unnamed"]
+        self.maxLen = state["maxLen"]
+        self.labels_human = {}
+        self.unnamed_counter = 0
+        self.addresses = []
+        self.named_addresses = []
+        self.indexed = False
+
+    def parse_labels_symtab(self, sym_table_rows: SymbolTableColumns, str_row_table: StringTable):
+        for i in sym_table_rows.indices_of_type(STT_FUNC):
+            name = str_row_table.get(int(sym_table_rows.st_name[i]))
+            if len(name) > 0 and name != " ":
+                self.named[int(sym_table_rows.st_value[i])] = name
+        self.build_index()
+
+    def add_unnamed_label(self, address: int):
+        if address not in self.named and address not in self.unnamed:
+            self.unnamed.add(address)
+            self.indexed = False
+
+    def build_index(self, relative: bool = False):
+        # Метки LOC_ нумеруются в порядке возрастания адреса; имена из .symtab имеют приоритет.
+        # relative - для частичного листинга, где сквозная нумерация неизвестна: см. relative_label
+        self.labels_human = dict(self.named)
+        self.named_addresses = sorted(self.named)
+        self.indexed = True
+        if relative:
+            for address in self.unnamed:
+                self.labels_human[address] = self.relative_label(address)
+        else:
+            for i, address in enumerate(sorted(self.unnamed)):
+                self.labels_human[address] = "LOC_{0:05x}".format(i)
+        self.unnamed_counter = len(self.unnamed)
+        self.addresses = sorted(self.labels_human)
+
+    def get_label(self, address: int) -> str:
+        if not self.indexed:
+            self.build_index()
+        return self.labels_human.get(address, "")
+
+    def nearest_label(self, address: int, named_only: bool = False):
+        # Ближайшая метка с адресом не больше address: (адрес метки, имя) или None
+        if not self.indexed:
+            self.build_index()
+        addresses = self.named_addresses if named_only else self.addresses
+        i = bisect_right(addresses, address) - 1
+        if i < 0:
+            return None
+        return addresses[i], self.labels_human[addresses[i]]
+
+    def relative_label(self, address: int) -> str:
+        # Имя символа, а без него - ближайший предшествующий символ со смещением
+        name = self.named.get(address)
+        if name is not None:
+            return name
+        nearest = self.nearest_label(address, named_only=True)
+        if nearest is None:
+            return "LOC_{0:08x}".format(address)
+        return "{0}+0x{1:x}".format(nearest[1], address - nearest[0])
+
+    def countMaxLen(self):
+        for ch in self.labels_human:
+            self.maxLen = max(self.maxLen, len(self.labels_human[ch]))
+
+    def format_label(self, address: int) -> str:
+        label = self.get_label(address)
+        # return "{:>{length}}".format(label, length = self.maxLen)
+        if label:
+            return "{:>{length}}: ".format(label, length=10)
+        return "{:>{length}}  ".format("", length=10)
+
+
+# Декодеры возвращают позиционно-независимую форму команды:
+# (мнемоника, операнды, смещение цели перехода или None).
+# Метка цели добавляется к операндам только при форматировании, см. format_record.
+UNKNOWN_COMMAND = ("unknown_command", "", None)
+
+
+def parseR(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    rs2 = (cmd >> 20) & 0b11111
+    funct7 = cmd >> 25
+    operation = R_OPERATIONS.get((funct7, funct3))
+    if operation is None:
+        return UNKNOWN_COMMAND
+
+    return operation, '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], ABI_REGS[rs2]), None
+
+
+def parseI(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    shamt = (cmd >> 20) & 0b11111
+    funct7 = cmd >> 25
+
+    if funct3 == 0b001:
+        if funct7 == 0b0000000:
+            return "slli", '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], shamt), None
+        return UNKNOWN_COMMAND
+    elif funct3 == 0b101:
+        if funct7 == 0b0000000:
+            operation = "srli"
+        elif funct7 == 0b0100000:
+            operation = "srai"
+        else:
+            return UNKNOWN_COMMAND
+        return operation, '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], shamt), None
+
+    return I_OPERATIONS[funct3], '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1],
+                                                        sign_extend(cmd >> 20, 12)), None
+
+
+def parseLoadI(cmd: int, operations: dict = LOAD_OPERATIONS):
+    rd = (cmd >> 7) & 0b11111
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    operation = operations.get(funct3)
+    if operation is None:
+        return UNKNOWN_COMMAND
+    return operation, '{0}, {1}({2})'.format(ABI_REGS[rd], sign_extend(cmd >> 20, 12), ABI_REGS[rs1]), None
+
+
+def parseB(cmd: int):
+    func3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    rs2 = (cmd >> 20) & 0b11111
+    operation = B_OPERATIONS.get(func3)
+    if operation is None:
+        return UNKNOWN_COMMAND
+
+    imm = (((cmd >> 31) & 0b1) << 12) | (((cmd >> 7) & 0b1) << 11) | (((cmd >> 25) & 0b111111) << 5) \
+        | (((cmd >> 8) & 0b1111) << 1)
+    return operation, '{0}, {1}, '.format(ABI_REGS[rs1], ABI_REGS[rs2]), sign_extend(imm, 13)
+
+
+def parseLui(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    return "lui", "{0}, {1}".format(ABI_REGS[rd], sign_extend(cmd >> 12, 20)), None
+
+
+def parseJal(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    # Смещение собирается из битов 31, 19..13, 20, 30..21 (бит 12 не используется)
+    imm = (((cmd >> 31) & 0b1) << 19) | (((cmd >> 13) & 0b1111111) << 12) | (((cmd >> 20) & 0b1) << 11) \
+        | (((cmd >> 21) & 0b1111111111) << 1)
+    return "jal", "{0}, ".format(ABI_REGS[rd]), sign_extend(imm, 20)
+
+
+def parseJalR(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    rs1 = (cmd >> 15) & 0b11111
+    return "jalr", '{0}, {1}({2})'.format(ABI_REGS[rd], sign_extend(cmd >> 20, 12), ABI_REGS[rs1]), None
+
+
+def parseAuipc(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    return "auipc", "{0}, {1}".format(ABI_REGS[rd], sign_extend(cmd >> 12, 20)), None
+
+
+def parseS(cmd: int, operations: dict = S_OPERATIONS):
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    rs2 = (cmd >> 20) & 0b11111
+    operation = operations.get(funct3)
+    if operation is None:
+        return UNKNOWN_COMMAND
+    imm = ((cmd >> 25) << 5) | ((cmd >> 7) & 0b11111)
+    return operation, "{0}, {1}({2})".format(ABI_REGS[rs2], sign_extend(imm, 12), ABI_REGS[rs1]), None
+
+
+def parseCSR(cmd: int):
+    if cmd >> 7 == 0:
+        return "ecall", "", None
+    elif cmd >> 7 == 1 << 13:
+        return "ebreak", "", None
+
+    csr = REGS_CSR.get(cmd >> 20)
+    operation = CSR_OPERATIONS.get((cmd >> 12) & 0b111)
+    if csr is None or operation is None:
+        return UNKNOWN_COMMAND
+    rd = (cmd >> 7) & 0b11111
+    if operation[-1] == "I":
+        uimm = (cmd >> 15) & 0b11111
+        return operation, "{0}, {1}, {2}".format(ABI_REGS[rd], csr, uimm), None
+    rs1 = (cmd >> 15) & 0b11111
+    return operation, "{0:05b}, {1}, {2}".format(rd, csr, ABI_REGS[rs1]), None
+
+
+OPCODE_HANDLERS = {
+    0b0110011: parseR,
+    0b0010011: parseI,
+    0b0000011: parseLoadI,
+    0b1100011: parseB,
+    0b0110111: parseLui,
+    0b1101111: parseJal,
+    0b1100111: parseJalR,
+    0b0010111: parseAuipc,
+    0b0100011: parseS,
+    0b1110011: parseCSR
+}
 
 
-    def parseSectionName(header: Header, section: Section, sections: object) -> str:
-        shstrtab = sections[header.e_shstrndx]
-        res = chr(get_bytes(section.sh_name + shstrtab.sh_offset, 1))
-        for i in range(1, 400):
-            cr = chr(get_bytes(section.sh_name + shstrtab.sh_offset + i, 1))
-            if get_bytes(section.sh_name + shstrtab.sh_offset + i, 1) == 0:
-                break
-            res = res + cr
-        return res
+def parse4BitCMD(cmd: int):
+    handler = OPCODE_HANDLERS.get(cmd & 0b1111111)
+    if handler is None:
+        return UNKNOWN_COMMAND
+    return handler(cmd)
+
+
+# Декодеры RV64: отличия от RV32 - 6-битный shamt, OP-32/OP-IMM-32 и ld/lwu/sd
+def parseI64(cmd: int):
+    funct3 = (cmd >> 12) & 0b111
+    if funct3 != 0b001 and funct3 != 0b101:
+        return parseI(cmd)
+    rd = (cmd >> 7) & 0b11111
+    rs1 = (cmd >> 15) & 0b11111
+    shamt = (cmd >> 20) & 0b111111
+    funct6 = cmd >> 26
+    if funct3 == 0b001:
+        if funct6 != 0b000000:
+            return UNKNOWN_COMMAND
+        operation = "slli"
+    elif funct6 == 0b000000:
+        operation = "srli"
+    elif funct6 == 0b010000:
+        operation = "srai"
+    else:
+        return UNKNOWN_COMMAND
+    return operation, '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], shamt), None
+
+
+def parseI64W(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    shamt = (cmd >> 20) & 0b11111
+    funct7 = cmd >> 25
+    if funct3 == 0b000:
+        return "addiw", '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], sign_extend(cmd >> 20, 12)), None
+    if funct3 == 0b001 and funct7 == 0b0000000:
+        operation = "slliw"
+    elif funct3 == 0b101 and funct7 == 0b0000000:
+        operation = "srliw"
+    elif funct3 == 0b101 and funct7 == 0b0100000:
+        operation = "sraiw"
+    else:
+        return UNKNOWN_COMMAND
+    return operation, '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], shamt), None
+
+
+def parseR64W(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    funct3 = (cmd >> 12) & 0b111
+    rs1 = (cmd >> 15) & 0b11111
+    rs2 = (cmd >> 20) & 0b11111
+    operation = R64_OPERATIONS.get((cmd >> 25, funct3))
+    if operation is None:
+        return UNKNOWN_COMMAND
+    return operation, '{0}, {1}, {2}'.format(ABI_REGS[rd], ABI_REGS[rs1], ABI_REGS[rs2]), None
+
+
+def parseLoadI64(cmd: int):
+    return parseLoadI(cmd, LOAD64_OPERATIONS)
+
+
+def parseS64(cmd: int):
+    return parseS(cmd, S64_OPERATIONS)
+
+
+OPCODE_HANDLERS_64 = {
+    **OPCODE_HANDLERS,
+    0b0010011: parseI64,
+    0b0000011: parseLoadI64,
+    0b0100011: parseS64,
+    0b0011011: parseI64W,
+    0b0111011: parseR64W
+}
 
 
-    def print_parsed_symbol_table_rows(sym_table: SymbolTable, str_table: Section, deltaOff: int):
-        res = ""
-        res = "[" + str(deltaOff).rjust(4) + "] " + hex(sym_table.st_value).ljust(17) + " " + str(
-            sym_table.st_size).rjust(5) + " " + SYMBOL_TYPES[sym_table.st_type].ljust(8) + " " + BIND_TYPES[
-                  sym_table.st_bind].ljust(8) + " " + str(SYMBOL_VIS[sym_table.st_vis]).ljust(8) + " "
+def parse4BitCMD64(cmd: int):
+    handler = OPCODE_HANDLERS_64.get(cmd & 0b1111111)
+    if handler is None:
+        return UNKNOWN_COMMAND
+    return handler(cmd)
 
-        if (sym_table.st_shndx in SYMBOL_IND):
-            res += str(SYMBOL_IND[sym_table.st_shndx]).rjust(6)
-        else:
-            res += str(sym_table.st_shndx).rjust(6)
-        res += " "
-        res += parse_label_name(sym_table, str_table)
-        return res
 
+def parseAddi4Spn(cmd: int):
+    imm = (((cmd >> 7) & 0b1111) << 6) | (((cmd >> 11) & 0b11) << 4) | (((cmd >> 5) & 0b1) << 3) \
+        | (((cmd >> 6) & 0b1) << 2)
+    rd = (cmd >> 2) & 0b111
 
-    def parse_label_name(sym_table_row: SymbolTable, str_row_table: Section) -> str:
-        res = ""
-        for i in range(100000):
-            c = get_bytes(sym_table_row.st_name + str_row_table.sh_offset + i, 1)
-            if c == 0:
-                break
-            res += chr(c)
-        return (res)
-
-
-    def getSectionByName(header: Header, sections: object, name: str) -> Section:
-        for el in sections:
-            if parseSectionName(header, el, sections) == name:
-                return el
-        raise ValueError("Section {0} not found".format(name))
-
-
-    def parse_symbol_table_rows(symtab: Section, sym_table_rows: object) -> None:
-        for i in range(symtab.sh_size // 16):
-            sym_table_rows.append(SymbolTable(symtab.sh_offset + 16 * i))
-
-
-    def parse_code_blocks(code: Section, code_arr: object) -> None:
-        for i in range(code.sh_size // 4):
-            code_arr.append(bin(get_bytes(code.sh_offset + i * 4, 4))[2:].rjust(32, "0"))
-
-
-    def get_num_from_bin_signed(x: str):
-        res = 0
-        for i in range(1, len(x)):
-            if x[i] == "1":
-                res += 1 << (len(x) - 1 - i)
-        if x[0] == "1":
-            res -= 1 << (len(x) - 1)
-        return (res)
-
-
-    def get_num_from_bin_unsigned(x: str):
-        res = 0
-        for i in x:
-            res = res * 2
-            res += int(i)
-        return res
-
-
-    class LabelsFormated:
-        def __init__(self, symtab_rows: List[SymbolTable], str_row_table_section: Section) -> None:
-            self.labels_human = {}
-            self.unnamed_counter = 0
-            self.maxLen = 9
-            self.parse_labels_symtab(symtab_rows, str_row_table_section)
-
-        def parse_labels_symtab(self, sym_table_rows: List[SymbolTable], str_row_table_section: Section):
-            for item in sym_table_rows:
-                if (SYMBOL_TYPES[item.st_type] == "FUNC"):
-                    name = parse_label_name(item, str_row_table_section)
-                    if len(name) > 0 and name != " ":
-                        labels[item.st_value] = name
-            self.labels_human = labels
-
-        def add_unnamed_label(self, address: int):
-            if not address in self.labels_human:
-                self.labels_human[address] = "LOC_{0}".format(hex(self.unnamed_counter)[2:].rjust(5, "0"))
-                self.unnamed_counter += 1
-
-        def get_label(self, address: int, round: int) -> str:
-            for i in range(address, address + round + 1):
-                if i in self.labels_human and not "LOC_" in self.labels_human[address]:
-                    return self.labels_human[address]
-            for i in range(address, address + round + 1):
-                if i in self.labels_human:
-                    return self.labels_human[address]
-            return ""
-
-        def countMaxLen(self):
-            for ch in self.labels_human:
-                self.maxLen = max(self.maxLen, len(self.labels_human[ch]))
-
-        def print_label(self, out, address: int, offset: int):
-            label = self.get_label(address, offset)
-            # out.write("{:>{length}}".format(label, length = self.maxLen))
-            out.write("{:>{length}}".format(label, length=10))
-            if (label and len(label) > 0):
-                out.write(": ")
-            else:
-                out.write("  ")
-
-        def print_empty_label(self, out):
-            out.write("{:>{length}}  ".format("", length=10))
-
-
-    def parseLX(cmd: str):
-        func3 = cmd[-15:-12]
-        rd_cmd = get_num_from_bin_unsigned(cmd[-12:-7])
-        rs_cmd = get_num_from_bin_unsigned(cmd[-12:-7])
-        name = ""
-        rs1 = ABI_REGS[rs_cmd]
-        rd = ABI_REGS[rd_cmd]
-        offset = get_num_from_bin_signed(cmd[-32:-20])
-        if func3 == "000":
-            name = "lb"
-        elif func3 == "001":
-            name = "lh"
-        elif func3 == "010":
-            name = "lw"
-        elif func3 == "100":
-            name = "lbu"
-        elif func3 == "101":
-            name = "lhu"
-        else:
-            raise Exception("function not found")
-        return "{0}   {1},{2}({3})".format(name, rd, offset, rs1)
-
-
-    def parseR(cmd: str):
-        rd = cmd[20:25]
-        funct3 = cmd[17:20]
-        rs1 = cmd[12:17]
-        rs2 = cmd[7:12]
-        funct7 = cmd[0:7]
-        operation = ""
-        if funct7 == "0000000":
-            if funct3 == "000":
-                operation = "add"
-            elif funct3 == "001":
-                operation = "sll"
-            elif funct3 == "010":
-                operation = "slt"
-            elif funct3 == "100":
-                operation = "xor"
-            elif funct3 == "101":
-                operation = "srl"
-            elif funct3 == "110":
-                operation = "or"
-            elif funct3 == "111":
-                operation = "and"
-            else:
-                operation = "unknown_command"
-        elif funct7 == "0000001":
-            if funct3 == "000":
-                operation = "mul"
-            elif funct3 == "001":
-                operation = "mulh"
-            elif funct3 == "011":
-                operation = "mulhu"
-            elif funct3 == "101":
-                operation = "divu"
-            elif funct3 == "110":
-                operation = "rem"
-            elif funct3 == "111":
-                operation = "remu"
-            else:
-                operation = "unknown_command"
-        elif funct7 == "0100000":
-            if funct3 == "000":
-                operation = "sub"
-            elif funct3 == "101":
-                operation = "sra"
-            else:
-                operation = "unknown_command"
-        else:
-            operation = "unknown_command"
-        if operation == "unknown_command":
-            return operation
+    if imm == 0:
+        return UNKNOWN_COMMAND
+    return "c.addi4spn", "{0}, {1}, {2}".format(ABI_REGS_COMPRESSED[rd], "sp", imm), None
 
-        return '{0} {1}, {2}, {3}'.format(operation, ABI_REGS[int(rd, 2)], ABI_REGS[int(rs1, 2)], ABI_REGS[int(rs2, 2)])
 
+def parseLW2b(cmd: int):
+    imm = (((cmd >> 5) & 0b1) << 6) | (((cmd >> 10) & 0b111) << 3) | (((cmd >> 6) & 0b1) << 2)
+    rs = (cmd >> 7) & 0b111
+    rd = (cmd >> 2) & 0b111
+    return "c.lw", "{0}, {1}({2})".format(ABI_REGS_COMPRESSED[rd], imm, ABI_REGS_COMPRESSED[rs]), None
 
-    def parseshamt(bin: str) -> str:
-        return (int(bin, 2))
 
+def parseSW2b(cmd: int):
+    imm = (((cmd >> 5) & 0b1) << 6) | (((cmd >> 10) & 0b111) << 3) | (((cmd >> 6) & 0b1) << 2)
+    rs = (cmd >> 7) & 0b111
+    rs2 = (cmd >> 2) & 0b111
+    return "c.sw", "{0}, {1}({2})".format(ABI_REGS_COMPRESSED[rs2], imm, ABI_REGS_COMPRESSED[rs]), None
 
-    def parseI(cmd: str) -> str:
-        rd = cmd[20:25]
-        funct3 = cmd[17:20]
-        rs1 = cmd[12:17]
-        imm = cmd[0:12]
 
-        shamt = cmd[7:12]
-        funct7 = cmd[0:7]
-        operation = "unknown_command"
+def parseADDI2(cmd: int):
+    imm = sign_extend(compressed_imm6(cmd), 6)
+    rd = (cmd >> 7) & 0b11111
+    if rd == 0:
+        return UNKNOWN_COMMAND
+    if imm == 0:
+        return UNKNOWN_COMMAND
+    return "c.addi", "{0}, {1}".format(ABI_REGS[rd], imm), None
 
-        if funct3 == "000":
-            operation = "addi"
-        elif funct3 == "001":
-            if funct7 == "0000000":
-                operation = "slli"
-                return '{0} {1}, {2}, {3}'.format(operation, ABI_REGS[int(rd, 2)], ABI_REGS[int(rs1, 2)],
-                                                  parseshamt(shamt))
-            else:
-                return "unknown_command"
-        elif funct3 == "010":
-            operation = "slti"
-        elif funct3 == "011":
-            operation = "SLTIU"
-        elif funct3 == "100":
-            operation = "xori"
-        elif funct3 == "101":
-            if funct7 == "0000000":
-                operation = "srli"
-            elif funct7 == "0100000":
-                operation = "srai"
-            else:
-                return "unknown_command"
-            return '{0} {1}, {2}, {3}'.format(operation, ABI_REGS[int(rd, 2)], ABI_REGS[int(rs1, 2)], parseshamt(shamt))
-        elif funct3 == "110":
-            operation = "ori"
-        elif funct3 == "111":
-            operation = "andi"
-
-        return '{0} {1}, {2}, {3}'.format(operation, ABI_REGS[int(rd, 2)], ABI_REGS[int(rs1, 2)],
-                                          get_num_from_bin_signed(imm))
-
-
-    def parseLoadI(cmd: str) -> str:
-        rd = cmd[20:25]
-        funct3 = cmd[17:20]
-        rs1 = cmd[12:17]
-        imm = cmd[0:12]
-        operation = "unknown_command"
-
-        if funct3 == "000":
-            operation = "lb"
-        elif funct3 == "001":
-            operation = "lh"
-        elif funct3 == "010":
-            operation = "lw"
-        elif funct3 == "100":
-            operation = "lbu"
-        elif funct3 == "101":
-            operation = "lhu"
-        if operation != "nvalid":
-            return '{0} {1}, {2}({3})'.format(operation, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm),
-                                              ABI_REGS[int(rs1, 2)])
-        return operation
-
-
-    def parseB(cmd: str, address: int, labels: LabelsFormated) -> str:
-        func3 = cmd[17:20]
-        rs1 = cmd[12:17]
-        rs2 = cmd[7:12]
-        immL = cmd[0:7]
-        immR = cmd[20:25]
-        operation = "unknown_command"
-
-        imm = immL[0] + immR[-1] + immL[1:] + immR[:-1] + "0"
-
-        if func3 == "000":
-            operation = "beq"
-        elif func3 == "001":
-            operation = "bne"
-        elif func3 == "100":
-            operation = "blt"
-        elif func3 == "101":
-            operation = "bqe"
-        elif func3 == "110":
-            operation = "bltu"
-        elif func3 == "111":
-            operation = "bgeu"
+
+def parseJAL2(cmd: int):
+    return "c.jal", "", compressed_jump_offset(cmd)
+
+
+def parseLI2(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    if rd == 0:
+        return UNKNOWN_COMMAND
+    return "c.li", "{0}, {1}".format(ABI_REGS[rd], sign_extend(compressed_imm6(cmd), 6)), None
+
+
+def parseAddi16Sp(cmd: int):
+    imm = (((cmd >> 12) & 0b1) << 9) | (((cmd >> 3) & 0b11) << 7) | (((cmd >> 5) & 0b1) << 6) \
+        | (((cmd >> 2) & 0b1) << 5) | (((cmd >> 6) & 0b1) << 4)
+    imm = sign_extend(imm, 10)
+    if imm == 0:
+        return UNKNOWN_COMMAND
+    return "c.addi16sp", "sp, {0}".format(imm), None
+
+
+def parseLui2(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    imm = sign_extend(compressed_imm6(cmd), 6) << 12
+    if imm == 0:
+        return UNKNOWN_COMMAND
+    return "c.lui", "{0}, {1}".format(ABI_REGS[rd], imm), None
+
+
+def parseAddi16SpAndLui(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    if rd == 2:
+        return parseAddi16Sp(cmd)
+    elif rd != 0:
+        return parseLui2(cmd)
+    return UNKNOWN_COMMAND
+
+
+def parseBlock100(cmd: int):
+    imm = compressed_imm6(cmd)
+    rd = (cmd >> 7) & 0b111
+    funct3 = (cmd >> 10) & 0b11
+    rs2 = (cmd >> 2) & 0b111
+
+    if funct3 == 0b00:
+        if imm != 0:
+            return "c.srli", "{0}, {1}".format(ABI_REGS_COMPRESSED[rd], imm), None
+    elif funct3 == 0b01:
+        if imm != 0:
+            return "c.srai", "{0}, {1}".format(ABI_REGS_COMPRESSED[rd], imm), None
+    elif funct3 == 0b10:
+        return "c.andi", "{0}, {1}".format(ABI_REGS_COMPRESSED[rd], sign_extend(imm, 6)), None
+    elif (cmd >> 12) & 0b1 == 0:
+        op = C_ARITH_OPERATIONS[(cmd >> 5) & 0b11]
+        return op, "{0}, {1}".format(ABI_REGS_COMPRESSED[rd], ABI_REGS_COMPRESSED[rs2]), None
+    return UNKNOWN_COMMAND
+
+
+def parseJ2(cmd: int):
+    return "c.j", "", sign_extend(compressed_jump_offset(cmd), 12)
+
+
+def parseBEQZBNEZ(cmd: int, command: str):
+    rs1 = (cmd >> 7) & 0b111
+    imm = (((cmd >> 12) & 0b1) << 8) | (((cmd >> 5) & 0b11) << 6) | (((cmd >> 2) & 0b1) << 5) \
+        | (((cmd >> 10) & 0b11) << 3) | (((cmd >> 3) & 0b11) << 1)
+    return command, "{0}, ".format(ABI_REGS_COMPRESSED[rs1]), sign_extend(imm, 9)
+
+
+def parseSLLI2(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    imm = compressed_imm6(cmd)
+    if imm == 0 or rd == 0:
+        return UNKNOWN_COMMAND
+    return "c.slli", "{0}, {1}".format(ABI_REGS[rd], imm), None
+
+
+def parseLWSP(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    imm = (((cmd >> 2) & 0b11) << 6) | (((cmd >> 12) & 0b1) << 5) | (((cmd >> 4) & 0b111) << 2)
+    if rd == 0:
+        return UNKNOWN_COMMAND
+    return "c.lwsp", "{0}, {1}(sp)".format(ABI_REGS[rd], imm), None
+
+
+def parseSys2(cmd: int):
+    rs1 = (cmd >> 7) & 0b11111
+    rs2 = (cmd >> 2) & 0b11111
+    if (cmd >> 12) & 0b1 == 0:
+        if rs1 == 0:
+            return UNKNOWN_COMMAND
+        if rs2 == 0:
+            return "c.jr", ABI_REGS[rs1], None
         else:
-            return "unknown_command"
+            return "c.mv", "{0}, {1}".format(ABI_REGS[rs1], ABI_REGS[rs2]), None
+    else:
+        if rs1 == 0 and rs2 == 0:
+            return "c.ebreak", "", None
+        elif rs2 == 0:
+            return "c.jalr", ABI_REGS[rs1], None
+        elif rs1 != 0 and rs2 != 0:
+            return "c.add", "{0}, {1}".format(ABI_REGS[rs1], ABI_REGS[rs2]), None
+    return UNKNOWN_COMMAND
+
+
+def parseSWDSP2(cmd: int, command: str):
+    rs2 = (cmd >> 2) & 0b11111
+    if command == "c.swsp":
+        imm = (((cmd >> 7) & 0b11) << 6) | (((cmd >> 9) & 0b1111) << 2)
+    else:
+        imm = (((cmd >> 7) & 0b111) << 5) | (((cmd >> 10) & 0b111) << 2)
+    return command, "{0}, {1}(sp)".format(ABI_REGS[rs2], imm), None
+
+
+def parseBEQZ2(cmd: int):
+    return parseBEQZBNEZ(cmd, "c.beqz")
+
+
+def parseBNEZ2(cmd: int):
+    return parseBEQZBNEZ(cmd, "c.bnez")
+
+
+def parseSWSP2(cmd: int):
+    return parseSWDSP2(cmd, "c.swsp")
+
+
+def parseSDSP32(cmd: int):
+    return parseSWDSP2(cmd, "c.sdsp")
+
+
+# Декодеры сжатых команд по (квадрант, funct3)
+RVC_HANDLERS = {
+    (0b00, 0b000): parseAddi4Spn,
+    (0b00, 0b010): parseLW2b,
+    (0b00, 0b110): parseSW2b,
+    # NOP (хз)
+    (0b01, 0b000): parseADDI2,
+    (0b01, 0b001): parseJAL2,
+    (0b01, 0b010): parseLI2,
+    (0b01, 0b011): parseAddi16SpAndLui,
+    (0b01, 0b100): parseBlock100,
+    (0b01, 0b101): parseJ2,
+    (0b01, 0b110): parseBEQZ2,
+    (0b01, 0b111): parseBNEZ2,
+    (0b10, 0b000): parseSLLI2,
+    (0b10, 0b010): parseLWSP,
+    (0b10, 0b100): parseSys2,
+    (0b10, 0b110): parseSWSP2,
+    (0b10, 0b111): parseSDSP32
+}
+
+
+def parse2BitCMD(cmd: int):
+    handler = RVC_HANDLERS.get((cmd & 0b11, (cmd >> 13) & 0b111))
+    if handler is None:
+        return UNKNOWN_COMMAND
+    return handler(cmd)
+
+
+# Сжатые команды RV64: c.ld/c.sd и c.ldsp/c.sdsp вместо команд с плавающей точкой, c.addiw вместо c.jal,
+# c.subw/c.addw в свободных кодах блока 100
+def parseLD2b(cmd: int):
+    imm = (((cmd >> 5) & 0b11) << 6) | (((cmd >> 10) & 0b111) << 3)
+    rs = (cmd >> 7) & 0b111
+    rd = (cmd >> 2) & 0b111
+    return "c.ld", "{0}, {1}({2})".format(ABI_REGS_COMPRESSED[rd], imm, ABI_REGS_COMPRESSED[rs]), None
+
+
+def parseSD2b(cmd: int):
+    imm = (((cmd >> 5) & 0b11) << 6) | (((cmd >> 10) & 0b111) << 3)
+    rs = (cmd >> 7) & 0b111
+    rs2 = (cmd >> 2) & 0b111
+    return "c.sd", "{0}, {1}({2})".format(ABI_REGS_COMPRESSED[rs2], imm, ABI_REGS_COMPRESSED[rs]), None
+
+
+def parseADDIW2(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    if rd == 0:
+        return UNKNOWN_COMMAND
+    return "c.addiw", "{0}, {1}".format(ABI_REGS[rd], sign_extend(compressed_imm6(cmd), 6)), None
+
+
+def parseBlock100W(cmd: int):
+    if (cmd >> 10) & 0b11 != 0b11 or (cmd >> 12) & 0b1 == 0:
+        return parseBlock100(cmd)
+    op = C_ARITH64_OPERATIONS.get((cmd >> 5) & 0b11)
+    if op is None:
+        return UNKNOWN_COMMAND
+    rd = (cmd >> 7) & 0b111
+    rs2 = (cmd >> 2) & 0b111
+    return op, "{0}, {1}".format(ABI_REGS_COMPRESSED[rd], ABI_REGS_COMPRESSED[rs2]), None
+
+
+def parseLDSP(cmd: int):
+    rd = (cmd >> 7) & 0b11111
+    imm = (((cmd >> 2) & 0b111) << 6) | (((cmd >> 12) & 0b1) << 5) | (((cmd >> 5) & 0b11) << 3)
+    if rd == 0:
+        return UNKNOWN_COMMAND
+    return "c.ldsp", "{0}, {1}(sp)".format(ABI_REGS[rd], imm), None
+
+
+def parseSDSP2(cmd: int):
+    rs2 = (cmd >> 2) & 0b11111
+    imm = (((cmd >> 7) & 0b111) << 6) | (((cmd >> 10) & 0b111) << 3)
+    return "c.sdsp", "{0}, {1}(sp)".format(ABI_REGS[rs2], imm), None
+
+
+RVC64_HANDLERS = {
+    (0b00, 0b011): parseLD2b,
+    (0b00, 0b111): parseSD2b,
+    (0b01, 0b001): parseADDIW2,
+    (0b01, 0b100): parseBlock100W,
+    (0b10, 0b011): parseLDSP,
+    (0b10, 0b111): parseSDSP2
+}
+
+
+def parse2BitCMD64(cmd: int):
+    handler = RVC64_HANDLERS.get((cmd & 0b11, (cmd >> 13) & 0b111))
+    if handler is None:
+        return parse2BitCMD(cmd)
+    return handler(cmd)
+
+
+# Ограниченные LRU-кэши декодирования по сырому слову команды.
+# Статистика попаданий/промахов доступна через cache_info().
+cached_parse4BitCMD = lru_cache(maxsize=DECODE_CACHE_SIZE)(parse4BitCMD)
+cached_parse2BitCMD = lru_cache(maxsize=DECODE_CACHE_SIZE)(parse2BitCMD)
+cached_parse4BitCMD64 = lru_cache(maxsize=DECODE_CACHE_SIZE)(parse4BitCMD64)
+cached_parse2BitCMD64 = lru_cache(maxsize=DECODE_CACHE_SIZE)(parse2BitCMD64)
+
+
+def decode_cache_info() -> dict:
+    return {"32": cached_parse4BitCMD.cache_info(), "16": cached_parse2BitCMD.cache_info(),
+            "rv64_32": cached_parse4BitCMD64.cache_info(), "rv64_16": cached_parse2BitCMD64.cache_info()}
+
+
+# Числовые поля операндов для колоночного вывода: по мнемонике - функции, достающие из сырого слова
+# (rd, rs1, rs2, imm). Функции только сдвигают и маскируют, поэтому работают и с int, и с массивами numpy.
+# Регистры - номера x0..x31 из явных полей формата (3-битные поля сжатых команд переведены в x8..x15),
+# неявные sp и ra не выставляются. imm - число так, как его печатает декодер: для переходов - смещение цели,
+# для CSR-команд - номер CSR (у csr*i в rs1 лежит uimm).
+def field_rd(cmd):
+    return (cmd >> 7) & 0b11111
+
+
+def field_rs1(cmd):
+    return (cmd >> 15) & 0b11111
 
-        # Генерируем метку новую, если это конечно имеет смысл
-        markInd = address + get_num_from_bin_signed(imm)
 
-        labels.add_unnamed_label(markInd)
-        return '{0} {1}, {2}, {4}'.format(operation, ABI_REGS[int(rs1, 2)], ABI_REGS[int(rs2, 2)],
-                                          get_num_from_bin_signed(imm), labels.get_label(markInd, 3))
+def field_rs2(cmd):
+    return (cmd >> 20) & 0b11111
 
 
-    def parseLui(cmd: str) -> str:
-        command = "lui"
-        rd = cmd[20:25]
-        imm = cmd[0:20]
-        return "{0} {1}, {2}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm))
+def field_imm_i(cmd):
+    return sign_extend(cmd >> 20, 12)
 
 
-    def parseJal(cmd: str, address: int, labels: LabelsFormated) -> str:
-        command = "jal"
-        rd = cmd[20:25]
-        t = cmd[:19]
-        imm = t[0] + t[12:20] + t[11] + t[1:11] + "0"
-        markInd = address + get_num_from_bin_signed(imm)
+def field_shamt(cmd):
+    return (cmd >> 20) & 0b11111
 
-        labels.add_unnamed_label(markInd)
-        return "{0} {1}, {3}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm),
-                                     labels.get_label(markInd, 3))
 
+def field_shamt64(cmd):
+    return (cmd >> 20) & 0b111111
 
-    def parseJalR(cmd: str) -> str:
-        rs1 = cmd[12:17]
-        rd = cmd[20:25]
-        imm = cmd[0:12]
-        command = "jalr"
 
-        return '{0} {1}, {3}({2})'.format(command, ABI_REGS[int(rd, 2)], ABI_REGS[int(rs1, 2)],
-                                          get_num_from_bin_signed(imm))
+def field_csr(cmd):
+    return cmd >> 20
 
 
-    def parseAuipc(cmd: str) -> str:
-        rd = cmd[20:25]
-        imm = cmd[0:20]
-        command = "auipc"
+def field_imm_s(cmd):
+    return sign_extend(((cmd >> 25) << 5) | ((cmd >> 7) & 0b11111), 12)
 
-        return "{0} {1}, {2}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm))
 
+def field_imm_b(cmd):
+    return sign_extend((((cmd >> 31) & 0b1) << 12) | (((cmd >> 7) & 0b1) << 11) | (((cmd >> 25) & 0b111111) << 5)
+                       | (((cmd >> 8) & 0b1111) << 1), 13)
 
-    def parseS(cmd: str) -> str:
-        imm = cmd[0:7] + cmd[20:25]
-        funct3 = cmd[17:20]
-        rs1 = cmd[12:17]
-        rs2 = cmd[7:12]
-        operation = "unknown_command"
-        if funct3 == "000":
-            operation = "sb"
-        elif funct3 == "001":
-            operation = "sh"
-        elif funct3 == "010":
-            operation = "sw"
-        return "{0} {1}, {3}({2})".format(operation, ABI_REGS[int(rs2, 2)], ABI_REGS[int(rs1, 2)],
-                                          get_num_from_bin_signed(imm))
 
+def field_imm_u(cmd):
+    return sign_extend(cmd >> 12, 20)
 
-    def parseCSR(cmd: str) -> str:
-        imm = cmd[0:12]
-        funct3 = cmd[17:20]
-        rd = cmd[20:25]
-        operation = "unknown_command"
 
-        if cmd[:-7] == "0000000000000000000000000":
-            return "ecall"
-        elif cmd[:-7] == "0000000000010000000000000":
-            return "ebreak"
+def field_imm_j(cmd):
+    return sign_extend((((cmd >> 31) & 0b1) << 19) | (((cmd >> 13) & 0b1111111) << 12) | (((cmd >> 20) & 0b1) << 11)
+                       | (((cmd >> 21) & 0b1111111111) << 1), 20)
+
+
+def field_c_rs2(cmd):
+    return (cmd >> 2) & 0b11111
+
+
+def field_c_low(cmd):
+    # rd'/rs2' в битах 4..2
+    return 8 + ((cmd >> 2) & 0b111)
+
+
+def field_c_high(cmd):
+    # rd'/rs1' в битах 9..7
+    return 8 + ((cmd >> 7) & 0b111)
+
+
+def field_c_imm6(cmd):
+    return sign_extend(compressed_imm6(cmd), 6)
+
+
+def field_c_addi4spn(cmd):
+    return (((cmd >> 7) & 0b1111) << 6) | (((cmd >> 11) & 0b11) << 4) | (((cmd >> 5) & 0b1) << 3) \
+        | (((cmd >> 6) & 0b1) << 2)
+
+
+def field_c_lw(cmd):
+    return (((cmd >> 5) & 0b1) << 6) | (((cmd >> 10) & 0b111) << 3) | (((cmd >> 6) & 0b1) << 2)
+
+
+def field_c_ld(cmd):
+    return (((cmd >> 5) & 0b11) << 6) | (((cmd >> 10) & 0b111) << 3)
+
+
+def field_c_addi16sp(cmd):
+    return sign_extend((((cmd >> 12) & 0b1) << 9) | (((cmd >> 3) & 0b11) << 7) | (((cmd >> 5) & 0b1) << 6)
+                       | (((cmd >> 2) & 0b1) << 5) | (((cmd >> 6) & 0b1) << 4), 10)
+
+
+def field_c_lui(cmd):
+    return field_c_imm6(cmd) << 12
+
+
+def field_c_j(cmd):
+    return sign_extend(compressed_jump_offset(cmd), 12)
+
+
+def field_c_branch(cmd):
+    return sign_extend((((cmd >> 12) & 0b1) << 8) | (((cmd >> 5) & 0b11) << 6) | (((cmd >> 2) & 0b1) << 5)
+                       | (((cmd >> 10) & 0b11) << 3) | (((cmd >> 3) & 0b11) << 1), 9)
+
+
+def field_c_lwsp(cmd):
+    return (((cmd >> 2) & 0b11) << 6) | (((cmd >> 12) & 0b1) << 5) | (((cmd >> 4) & 0b111) << 2)
+
+
+def field_c_ldsp(cmd):
+    return (((cmd >> 2) & 0b111) << 6) | (((cmd >> 12) & 0b1) << 5) | (((cmd >> 5) & 0b11) << 3)
+
+
+def field_c_swsp(cmd):
+    return (((cmd >> 7) & 0b11) << 6) | (((cmd >> 9) & 0b1111) << 2)
+
+
+def field_c_sdsp32(cmd):
+    return (((cmd >> 7) & 0b111) << 5) | (((cmd >> 10) & 0b111) << 2)
+
+
+def field_c_sdsp(cmd):
+    return (((cmd >> 7) & 0b111) << 6) | (((cmd >> 10) & 0b111) << 3)
+
+
+OPERAND_FIELD_NAMES = ("rd", "rs1", "rs2", "imm")
+NO_OPERAND_FIELDS = (None, None, None, None)
+OPERAND_FIELDS = {
+    **{operation: (field_rd, field_rs1, field_rs2, None)
+       for operation in list(R_OPERATIONS.values()) + list(R64_OPERATIONS.values())},
+    **{operation: (field_rd, field_rs1, None, field_imm_i)
+       for operation in list(I_OPERATIONS.values()) + list(LOAD64_OPERATIONS.values()) + ["jalr", "addiw"]},
+    **{operation: (field_rd, field_rs1, None, field_shamt)
+       for operation in ("slli", "srli", "srai", "slliw", "srliw", "sraiw")},
+    **{operation: (None, field_rs1, field_rs2, field_imm_s) for operation in S64_OPERATIONS.values()},
+    **{operation: (None, field_rs1, field_rs2, field_imm_b) for operation in B_OPERATIONS.values()},
+    **{operation: (field_rd, field_rs1, None, field_csr) for operation in CSR_OPERATIONS.values()},
+    "lui": (field_rd, None, None, field_imm_u),
+    "auipc": (field_rd, None, None, field_imm_u),
+    "jal": (field_rd, None, None, field_imm_j),
+    "c.addi4spn": (field_c_low, None, None, field_c_addi4spn),
+    "c.lw": (field_c_low, field_c_high, None, field_c_lw),
+    "c.sw": (None, field_c_high, field_c_low, field_c_lw),
+    "c.ld": (field_c_low, field_c_high, None, field_c_ld),
+    "c.sd": (None, field_c_high, field_c_low, field_c_ld),
+    "c.addi": (field_rd, field_rd, None, field_c_imm6),
+    "c.addiw": (field_rd, field_rd, None, field_c_imm6),
+    "c.li": (field_rd, None, None, field_c_imm6),
+    "c.jal": (None, None, None, compressed_jump_offset),
+    "c.addi16sp": (field_rd, field_rd, None, field_c_addi16sp),
+    "c.lui": (field_rd, None, None, field_c_lui),
+    "c.srli": (field_c_high, field_c_high, None, compressed_imm6),
+    "c.srai": (field_c_high, field_c_high, None, compressed_imm6),
+    "c.andi": (field_c_high, field_c_high, None, field_c_imm6),
+    **{operation: (field_c_high, field_c_high, field_c_low, None)
+       for operation in list(C_ARITH_OPERATIONS.values()) + list(C_ARITH64_OPERATIONS.values())},
+    "c.j": (None, None, None, field_c_j),
+    "c.beqz": (None, field_c_high, None, field_c_branch),
+    "c.bnez": (None, field_c_high, None, field_c_branch),
+    "c.slli": (field_rd, field_rd, None, compressed_imm6),
+    "c.lwsp": (field_rd, None, None, field_c_lwsp),
+    "c.ldsp": (field_rd, None, None, field_c_ldsp),
+    "c.jr": (None, field_rd, None, None),
+    "c.jalr": (None, field_rd, None, None),
+    "c.mv": (field_rd, None, field_c_rs2, None),
+    "c.add": (field_rd, field_rd, field_c_rs2, None),
+    "c.swsp": (None, None, field_c_rs2, field_c_swsp),
+    "c.sdsp": (None, None, field_c_rs2, field_c_sdsp32),
+}
+OPERAND_FIELDS_64 = {
+    **OPERAND_FIELDS,
+    "slli": (field_rd, field_rs1, None, field_shamt64),
+    "srli": (field_rd, field_rs1, None, field_shamt64),
+    "srai": (field_rd, field_rs1, None, field_shamt64),
+    "c.sdsp": (None, None, field_c_rs2, field_c_sdsp)
+}
+
+
+def operand_fields(mnemonic_id: int, word: int, xlen: int = 32) -> tuple:
+    # (rd, rs1, rs2, imm, funct3, funct7) одной команды; регистра нет в формате - COLUMNAR_NO_REGISTER, imm - 0.
+    # funct3 и funct7 - сырые поля слова, у сжатых команд funct3 - биты 15..13, а funct7 - 0
+    extractors = (OPERAND_FIELDS_64 if xlen == 64 else OPERAND_FIELDS).get(MNEMONICS[mnemonic_id], NO_OPERAND_FIELDS)
+    registers = tuple(COLUMNAR_NO_REGISTER if field is None else field(word) for field in extractors[:3])
+    imm = 0 if extractors[3] is None else extractors[3](word)
+    if word & 0b11 == 0b11:
+        return registers + (imm, (word >> 12) & 0b111, word >> 25)
+    return registers + (imm, word >> 13, 0)
+
+
+def batch_operand_fields(mnemonics, words, xlen: int = 32) -> dict:
+    # operand_fields для всех команд сразу: команды группируются по мнемонике, и каждое поле считается
+    # один раз на группу
+    table = OPERAND_FIELDS_64 if xlen == 64 else OPERAND_FIELDS
+    mnemonics = np.asarray(mnemonics)
+    words = np.asarray(words, dtype=np.int64)
+    fields = batch_fields(words)
+    is32 = (words & 0b11) == 0b11
+    columns = {name: np.full(len(words), COLUMNAR_NO_REGISTER, dtype=np.uint8) for name in OPERAND_FIELD_NAMES[:3]}
+    columns["imm"] = np.zeros(len(words), dtype=np.int64)
+    columns["funct3"] = np.where(is32, fields["funct3"], words >> 13)
+    columns["funct7"] = np.where(is32, fields["funct7"], 0)
+    order = np.argsort(mnemonics, kind="stable")
+    ids, starts = np.unique(mnemonics[order], return_index=True)
+    bounds = starts.tolist() + [len(order)]
+    for i, mnemonic_id in enumerate(ids.tolist()):
+        rows = order[bounds[i]:bounds[i + 1]]
+        group = words[rows]
+        for name, field in zip(OPERAND_FIELD_NAMES, table.get(MNEMONICS[mnemonic_id], NO_OPERAND_FIELDS)):
+            if field is not None:
+                columns[name][rows] = field(group)
+    return columns
+
+
+# Запись декодированной команды: (адрес, длина, номер мнемоники в MNEMONICS, операнды, адрес цели или None)
+def decode_window(base_address: int, offsets, sizes, words, decode2BitCMD, decode4BitCMD=cached_parse4BitCMD,
+                  stats: "RunStats" = None, xlen: int = 32) -> list:
+    # Записи команд окна code_windows или его части (offsets, sizes, words - массивы): все режимы вывода
+    # декодируют только здесь. Со stats команды окна заодно попадают в счётчики
+    records = []
+    append = records.append
+    for offset, size, word in zip(offsets.tolist(), sizes.tolist(), words.tolist()):
+        mnemonic, operands, jump = decode4BitCMD(word) if size == 4 else decode2BitCMD(word)
+        address = base_address + offset
+        append((address, size, MNEMONIC_IDS[mnemonic], operands, None if jump is None else address + jump))
+    if stats is not None:
+        stats.count_instructions(words, sizes, sum(1 for record in records if not record[2]), xlen)
+    return records
+
+
+def format_record(record: tuple, labels: LabelsFormated) -> str:
+    address, size, mnemonic_id, operands, target = record
+    if target is not None:
+        return MNEMONICS[mnemonic_id] + " " + operands + labels.get_label(target)
+    if operands:
+        return MNEMONICS[mnemonic_id] + " " + operands
+    return MNEMONICS[mnemonic_id]
+
+
+def format_listing_line(record: tuple, labels: LabelsFormated) -> str:
+    if record[2]:
+        return "{0:08x} {1}{2}\n".format(record[0], labels.format_label(record[0]), format_record(record, labels))
+    return "{0:08x} {1:>10}  unknown_command\n".format(record[0], "")
+
+
+class ListingWriter:
+    # Собирает строки листинга пачками и пишет их одним writelines на пачку
+    def __init__(self, out, batch_lines: int = OUTPUT_BATCH_LINES) -> None:
+        self.out = out
+        self.batch_lines = batch_lines
+
+    def write_lines(self, lines) -> None:
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.batch_lines))
+            if not batch:
+                break
+            self.out.writelines(batch)
+
+
+def estimate_listing_size(code_size: int, symbols_count: int) -> int:
+    # С запасом: ~40 символов на 4 байта кода и ~100 на строку .symtab. Буфер не больше IN_MEMORY_BUFFER_LIMIT:
+    # листинг большего файла сбрасывается на диск кусками по размеру буфера
+    return min(code_size * 16 + symbols_count * 100 + 4096, IN_MEMORY_BUFFER_LIMIT)
+
+
+# Колоночный формат вывода (--format columnar), все числа little-endian:
+#   заголовок   COLUMNAR_HEADER: "RVCL", версия, xlen, 0, число колонок, 0
+#   оглавление  по COLUMNAR_ENTRY на колонку: имя, dtype в записи numpy, число элементов, смещение от начала файла
+#   данные      колонки подряд, каждая выровнена на 8 байт
+# Колонку можно прочитать целиком через numpy.fromfile(path, dtype, count, offset=offset) или из mmap, см. read_columns.
+# dtype колонки берётся из оглавления: для ELF32 адреса и размеры (COLUMNAR_ADDRESS_COLUMNS) пишутся как <u4.
+# Строки (мнемоники, имена меток, секций и символов) хранятся в общем пуле: колонки со строками содержат
+# номер строки в пуле, i-я строка - pool[pool_offsets[i]:pool_offsets[i + 1]]. Пул начинается с MNEMONICS,
+# поэтому номер мнемоники в пуле совпадает с её номером в MNEMONICS. Операнды команд - числа (rd, rs1, rs2, imm,
+# funct3, funct7), а не текст.
+COLUMNAR_HEADER = struct.Struct("<4sHBBII")
+COLUMNAR_ENTRY = struct.Struct("<16s8sQQ")
+COLUMNAR_COLUMNS = (
+    # Команды; target_offset - смещение цели перехода от адреса команды или COLUMNAR_NO_TARGET
+    ("address", "<u8"), ("length", "<u1"), ("word", "<u4"), ("mnemonic", "<u2"), ("target_offset", "<i4"),
+    # Поля операндов из сырого слова, см. operand_fields
+    ("rd", "<u1"), ("rs1", "<u1"), ("rs2", "<u1"), ("imm", "<i4"), ("funct3", "<u1"), ("funct7", "<u1"),
+    # Метки, как в текстовом листинге
+    ("label_address", "<i8"), ("label_name", "<u4"),
+    # Секции кода
+    ("section_name", "<u4"), ("section_address", "<u8"), ("section_size", "<u8"),
+    # .symtab, поля как в SymbolTableColumns
+    ("st_name", "<u4"), ("st_value", "<u8"), ("st_size", "<u8"), ("st_type", "<u1"), ("st_bind", "<u1"),
+    ("st_vis", "<u1"), ("st_shndx", "<u2"),
+    ("pool_offsets", "<u8"), ("pool", "<u1"),
+)
+COLUMNAR_ADDRESS_COLUMNS = ("address", "section_address", "section_size", "st_value", "st_size")
+COLUMNAR_TYPECODES = {"<u1": "B", "<u2": "H", "<u4": "I", "<i4": "i", "<u8": "Q", "<i8": "q"}
+
+
+class StringPool:
+    def __init__(self, strings=()) -> None:
+        self.ids = {}
+        for string in strings:
+            self.add(string)
+
+    def add(self, string: str) -> int:
+        i = self.ids.get(string)
+        if i is None:
+            i = self.ids[string] = len(self.ids)
+        return i
+
+    def columns(self) -> tuple:
+        # (pool_offsets, pool)
+        data = "".join(self.ids).encode("latin-1")
+        offsets = array("Q", [0])
+        for string in self.ids:
+            offsets.append(offsets[-1] + len(string))
+        return offsets, data
+
+
+def column_bytes(data, dtype: str) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if np is not None:
+        return np.asarray(data).astype(dtype, copy=False).tobytes()
+    typecode = COLUMNAR_TYPECODES[dtype]
+    if not isinstance(data, array) or data.typecode != typecode:
+        data = array(typecode, data)
+    if sys.byteorder == "big":
+        data = array(typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def write_columns(out, columns: dict, xlen: int) -> None:
+    # columns - {имя: массив numpy, array или bytes} для всех COLUMNAR_COLUMNS
+    dtypes = [(name, "<u4" if xlen == 32 and name in COLUMNAR_ADDRESS_COLUMNS else dtype)
+              for name, dtype in COLUMNAR_COLUMNS]
+    blobs = [column_bytes(columns[name], dtype) for name, dtype in dtypes]
+    offset = COLUMNAR_HEADER.size + COLUMNAR_ENTRY.size * len(dtypes)
+    entries = []
+    for (name, dtype), blob in zip(dtypes, blobs):
+        offset += -offset % 8
+        entries.append(COLUMNAR_ENTRY.pack(name.encode(), dtype.encode(), len(blob) // int(dtype[2:]), offset))
+        offset += len(blob)
+    out.write(COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, xlen, 0, len(COLUMNAR_COLUMNS), 0))
+    out.write(b"".join(entries))
+    position = COLUMNAR_HEADER.size + COLUMNAR_ENTRY.size * len(COLUMNAR_COLUMNS)
+    for blob in blobs:
+        out.write(bytes(-position % 8))
+        position += -position % 8
+        out.write(blob)
+        position += len(blob)
+
+
+def read_columns(path: str) -> dict:
+    # Все колонки файла без копирования: массивы numpy поверх mmap, без numpy - array
+    data = map_file(path)
+    magic, version, xlen, _, count, _ = COLUMNAR_HEADER.unpack_from(data, 0)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("{0} is not a columnar listing".format(path))
+    columns = {}
+    for i in range(count):
+        name, dtype, length, offset = COLUMNAR_ENTRY.unpack_from(data, COLUMNAR_HEADER.size + COLUMNAR_ENTRY.size * i)
+        name, dtype = name.rstrip(b"\0").decode(), dtype.rstrip(b"\0").decode()
+        if np is not None:
+            columns[name] = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
         else:
-            csr = "unknown_command"
-            if int(imm, 2) in REGS_CSR:
-                csr = REGS_CSR[int(imm, 2)]
-            else:
-                return csr
-            if funct3 == "001":
-                operation = "CSRRW"
-            elif funct3 == "010":
-                operation = "CSRRS"
-            elif funct3 == "011":
-                operation = "CSRRC"
-            elif funct3 == "101":
-                operation = "CSRRWI"
-            elif funct3 == "110":
-                operation = "CSRRSI"
-            elif funct3 == "111":
-                operation = "CSRRCI"
-            else:
-                return operation
-            if operation[-1] == "I":
-                uimm = cmd[12:17]
-                return "{0} {1}, {2}, {3}".format(operation, ABI_REGS[int(rd, 2)], csr, int(uimm, 2))
-            rs1 = cmd[12:17]
-            return "{0} {1}, {2}, {3}".format(operation, rd, csr, ABI_REGS[int(rs1, 2)])
-        return "unknown_command"
-
-
-    def parse4BitCMD(cmd: str, address: int, labels: LabelsFormated):
-        opcode = cmd[-7:]
-        if opcode == "0110011":
-            return parseR(cmd)
-        elif opcode == "0010011":
-            return parseI(cmd)
-        elif opcode == "0000011":
-            return parseLoadI(cmd)
-        elif opcode == "1100011":
-            return parseB(cmd, address, labels)
-        elif opcode == "0110111":
-            return parseLui(cmd)
-        elif opcode == "1101111":
-            return parseJal(cmd, address, labels)
-        elif opcode == "1100111":
-            return parseJalR(cmd)
-        elif opcode == "0010111":
-            return parseAuipc(cmd)
-        elif opcode == "0100011":
-            return parseS(cmd)
-        elif opcode == "1110011":
-            return parseCSR(cmd)
-        return "unknown_command"
-
-
-    def parseAddi4Spn(cmd: str):
-        t = cmd[3:-5]
-        imm = t[2:6] + t[:2] + t[-1] + t[-2] + 2 * "0"
-        rd = cmd[-5:-2]
-        command = "c.addi4spn"
-
-        if int(imm, 2) == 0:
-            return "unknown_command"
-        return "{0} {1}, {2}, {3}".format(command, ABI_REGS_COMPRESSED[int(rd, 2)], "sp", int(imm, 2))
-
-
-    def parseLW2b(cmd: str) -> str:
-        imm = cmd[-6] + cmd[-13:-10] + cmd[-7] + 2 * "0"
-        rs = cmd[-10: -7]
-        rd = cmd[-5:-2]
-        command = "c.lw"
-        return "{0} {1}, {2}({3})".format(command, ABI_REGS_COMPRESSED[int(rd, 2)], int(imm, 2),
-                                          ABI_REGS_COMPRESSED[int(rs, 2)])
-
-
-    def parseSW2b(cmd: str) -> str:
-        imm = cmd[-6] + cmd[-13:-10] + cmd[-7] + 2 * "0"
-        rs = cmd[-10: -7]
-        rs2 = cmd[-5:-2]
-        command = "c.sw"
-        return "{0} {1}, {2}({3})".format(command, ABI_REGS_COMPRESSED[int(rs2, 2)], int(imm, 2),
-                                          ABI_REGS_COMPRESSED[int(rs, 2)])
-
-
-    def parseADDI2(cmd: str) -> str:
-        imm = cmd[3] + cmd[-7:-2]
-        rd = cmd[-12:-7]
-        command = "c.addi"
-        if int(rd, 2) == 0:
-            return "unknown_command"
-        if get_num_from_bin_signed(imm) == 0:
-            return "unknown_command"
-        return "{0} {1}, {2}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm))
-
-
-    def parseJAL2(cmd: str, address: int, labels: LabelsFormated):
-        t = cmd[-13:-2]
-        command = "c.jal"
-        imm = t[0] + t[4] + t[2:4] + t[6] + t[5] + t[-1] + t[1] + t[-4:-1] + "0"
-        markInd = address + int(imm, 2)
-        labels.add_unnamed_label(markInd)
-
-        return "{0} {1}".format(command, labels.get_label(markInd, 3))
-
-
-    def parseLI2(cmd: str) -> str:
-        imm = cmd[3] + cmd[-7:-2]
-        command = "c.li"
-        rd = cmd[-12:-7]
-        if rd == "00000":
-            return "unknown_command"
-        return "{0} {1}, {2}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm))
-
-
-    def parseAddi16Sp(cmd: str) -> str:
-        imm = cmd[-13] + cmd[-5:-3] + cmd[-6] + cmd[-3] + cmd[-7] + 4 * "0"
-        command = "c.addi16sp"
-        if get_num_from_bin_signed(imm) == 0:
-            return "unknown_command"
-        return "{0} sp, {1}".format(command, get_num_from_bin_signed(imm))
-
-
-    def parseLui2(cmd: str) -> str:
-        rd = cmd[-12:-7]
-        imm = cmd[-13] + cmd[-7:-2] + 12 * "0"
-        command = "c.lui"
-        if get_num_from_bin_signed(imm) == 0:
-            return "unknown_command"
-        return "{0} {1}, {2}".format(command, ABI_REGS[int(rd, 2)], get_num_from_bin_signed(imm))
-
-
-    def parseAddi16SpAndLui(cmd: str) -> str:
-        rd = cmd[-12:-7]
-        if int(rd, 2) == 2:
-            return parseAddi16Sp(cmd)
-        elif int(rd, 2) != 0:
-            return parseLui2(cmd)
-        return "unknown_command"
-
-
-    def parseBlock100(cmd: str) -> str:
-        imm = cmd[-13] + cmd[-7:-2]
-        rd = cmd[-10:-7]
-        funct3 = cmd[-12:-10]
-        rs2 = cmd[-5:-2]
-
-        operation = "unknown_command"
-        if funct3 == "00":
-            if int(imm, 2) != 0:
-                return "{0} {1}, {2}".format("c.srli", ABI_REGS_COMPRESSED[int(rd, 2)], int(imm, 2))
-        elif funct3 == "01":
-            if int(imm, 2) != 0:
-                return "{0} {1}, {2}".format("c.srai", ABI_REGS_COMPRESSED[int(rd, 2)], int(imm, 2))
-        elif funct3 == "10":
-            return "{0} {1}, {2}".format("c.andi", ABI_REGS_COMPRESSED[int(rd, 2)], get_num_from_bin_signed(imm))
+            column = array(COLUMNAR_TYPECODES[dtype])
+            column.frombytes(data[offset:offset + length * column.itemsize])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns[name] = column
+    return columns
+
+
+def column_strings(columns: dict) -> list:
+    # Пул строк из read_columns списком str
+    offsets, pool = columns["pool_offsets"].tolist(), bytes(columns["pool"])
+    return [pool[offsets[i]:offsets[i + 1]].decode("latin-1") for i in range(len(offsets) - 1)]
+
+
+def section_title(section: Section, first: bool) -> str:
+    # Заголовок секции кода в листинге; перед следующими секциями - пустая строка, как перед .symtab
+    return "{0}\n".format(section.name) if first else "\n{0}\n".format(section.name)
+
+
+# Имена декодеров сжатых команд по (квадрант, funct3) из таблиц parse2BitCMD/parse2BitCMD64;
+# нужны только для статистики
+RVC_HANDLER_NAMES = {key: handler.__name__ for key, handler in RVC_HANDLERS.items()}
+RVC64_HANDLER_NAMES = {**RVC_HANDLER_NAMES, **{key: handler.__name__ for key, handler in RVC64_HANDLERS.items()}}
+
+
+class RunStats:
+    # Время этапов и счётчики одного запуска. Собираются, только если объект передан в ElfFile/disassemble,
+    # поэтому без --stats стоимость - несколько проверок на None за весь файл.
+
+    def __init__(self) -> None:
+        self.stages = {}
+        self.counters = {}
+        self.handlers = {}
+
+    def stage(self, name: str, started: float) -> float:
+        now = perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - started
+        return now
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_instructions(self, words, sizes, unknown: int, xlen: int = 32) -> None:
+        # Счётчики по декодерам считаются по сырым словам, уже после декодирования
+        handlers32 = OPCODE_HANDLERS_64 if xlen == 64 else OPCODE_HANDLERS
+        handlers16 = RVC64_HANDLER_NAMES if xlen == 64 else RVC_HANDLER_NAMES
+        if np is not None:
+            words = np.asarray(words, dtype=np.uint32)
+            is32 = np.asarray(sizes) == 4
+            count32 = int(is32.sum())
+            keys = [(handlers32.get(int(opcode)), int(n)) for opcode, n in
+                    zip(*np.unique(words[is32] & 0b1111111, return_counts=True))]
+            keys += [(handlers16.get((int(key) & 0b11, int(key) >> 13)), int(n)) for key, n in
+                     zip(*np.unique(words[~is32] & 0b1110000000000011, return_counts=True))]
         else:
-            funct4 = cmd[-7:-5]
-            t = cmd[-13]
-            op = "unknown_command"
-
-            if t == "0":
-                if funct4 == "00":
-                    op = "c.sub"
-                elif funct4 == "01":
-                    op = "c.xor"
-                elif funct4 == "10":
-                    op = "c.or"
+            keys = []
+            count32 = 0
+            for word, size in zip(words, sizes):
+                if size == 4:
+                    count32 += 1
+                    keys.append((handlers32.get(word & 0b1111111), 1))
                 else:
-                    op = "c.and"
-                return "{0} {1}, {2}".format(op, ABI_REGS_COMPRESSED[int(rd, 2)], ABI_REGS_COMPRESSED[int(rs2, 2)])
-        return operation
-
-
-    def parseJ2(cmd: str, address: int, labels: LabelsFormated):
-        t = cmd[-13:-2]
-        command = "c.j"
-        imm = t[0] + t[4] + t[2:4] + t[6] + t[5] + t[-1] + t[1] + t[-4:-1] + "0"
-        markInd = address + get_num_from_bin_signed(imm)
-        labels.add_unnamed_label(markInd)
-        return "{0} {1}".format(command, labels.get_label(markInd, 1))
-
-
-    def parseBEQZBNEZ(cmd: str, address: int, labels: LabelsFormated, command: str) -> str:
-        rs1 = cmd[-10:-7]
-        imm = cmd[-13] + cmd[-7:-5] + cmd[-3] + cmd[-12:-10] + cmd[-5:-3] + "0"
-        markInd = address + get_num_from_bin_signed(imm)
-        labels.add_unnamed_label(markInd)
-        return "{0} {1}, {3}".format(command, ABI_REGS_COMPRESSED[int(rs1, 2)], get_num_from_bin_signed(imm),
-                                     labels.get_label(markInd, 1))
-
-
-    def parseSLLI2(cmd: str) -> str:
-        rd = cmd[-12:-7]
-        imm = cmd[-13] + cmd[-7:-2]
-        if int(imm, 2) == 0 or int(rd, 2) == 0:
-            return "unknown_command"
-        return "{0} {1}, {2}".format("c.slli", ABI_REGS[int(rd, 2)], int(imm, 2))
-
-
-    def parseLWSP(cmd: str) -> str:
-        rd = cmd[-12:-7]
-        imm = cmd[-4:-2] + cmd[-13] + cmd[-7:-4] + 2 * "0"
-        if int(rd) == 0:
-            return "unknown_command"
-        return "{0} {1}, {2}(sp)".format("c.lwsp", ABI_REGS[int(rd, 2)], int(imm, 2))
-
-
-    def parseSys2(cmd: str, address: int, labels: LabelsFormated) -> str:
-        rs1 = cmd[-12:-7]
-        rs2 = cmd[-7:-2]
-        c = cmd[-13]
-        if c == "0":
-            if int(rs1, 2) == 0:
-                return "unknown_command"
-            if int(rs2, 2) == 0:
-                return "{0} {1}".format("c.jr", ABI_REGS[int(rs1, 2)])
-            else:
-                return "{0} {1}, {2}".format("c.mv", ABI_REGS[int(rs1, 2)], ABI_REGS[int(rs2, 2)])
+                    keys.append((handlers16.get((word & 0b11, (word >> 13) & 0b111)), 1))
+        for handler, n in keys:
+            if handler is not None and not isinstance(handler, str):
+                handler = handler.__name__
+            handler = handler or "unknown_opcode"
+            self.handlers[handler] = self.handlers.get(handler, 0) + n
+        self.count("instructions", len(sizes))
+        self.count("instructions_32", count32)
+        self.count("instructions_rvc", len(sizes) - count32)
+        self.count("unknown_instructions", unknown)
+
+    def count_labels(self, labels: LabelsFormated) -> None:
+        self.count("labels_named", len(labels.named))
+        self.count("labels_unnamed", len(labels.unnamed))
+
+    def as_dict(self) -> dict:
+        return {"stages": dict(self.stages), "counters": dict(self.counters), "handlers": dict(self.handlers)}
+
+    def add(self, stats: dict) -> None:
+        for name, seconds in stats["stages"].items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, value in stats["counters"].items():
+            self.count(name, value)
+        for name, value in stats["handlers"].items():
+            self.handlers[name] = self.handlers.get(name, 0) + value
+
+    def format(self, fmt: str = "text") -> str:
+        if fmt == "json":
+            return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        lines = ["Stages:"]
+        lines += ["  {0:<16} {1:>10.4f} s".format(name, seconds) for name, seconds in self.stages.items()]
+        lines.append("  {0:<16} {1:>10.4f} s".format("total", sum(self.stages.values())))
+        lines.append("Counters:")
+        lines += ["  {0:<22} {1:>10}".format(name, value) for name, value in self.counters.items()]
+        lines.append("Handlers:")
+        lines += ["  {0:<22} {1:>10}".format(name, value)
+                  for name, value in sorted(self.handlers.items(), key=lambda item: -item[1])]
+        return "\n".join(lines)
+
+
+class Instruction:
+    __slots__ = ("address", "size", "word", "mnemonic", "operands", "target", "target_label")
+
+    def __init__(self, address: int, size: int, word: int, mnemonic: str, operands: str, target, target_label) -> None:
+        self.address = address
+        self.size = size
+        self.word = word
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.target = target
+        self.target_label = target_label
+
+    def __repr__(self) -> str:
+        return "Instruction({0:08x}, {1}, {2:#x}, {3!r}, {4!r}, {5!r})".format(
+            self.address, self.size, self.word, self.mnemonic, self.operands, self.target_label)
+
+
+class Symbolizer:
+    # Интервальный индекс символов FUNC/OBJECT из .symtab: адрес -> символ и смещение от его начала.
+    # Пересекающиеся интервалы раскладываются на непересекающиеся отрезки, в каждом - самый внутренний символ
+    # (с наибольшим началом, при равенстве - самый короткий). Символ без размера длится до начала следующего
+    # символа или до конца своей секции. Поиск пачки адресов - один searchsorted по началам отрезков.
+
+    def __init__(self, symbols: SymbolTableColumns, str_table: StringTable, sections: list = ()) -> None:
+        rows = [i for i, (st_type, st_shndx) in enumerate(zip(symbols.st_type.tolist(), symbols.st_shndx.tolist()))
+                if st_type in (STT_FUNC, STT_OBJECT) and st_shndx != 0]
+        self.rows = rows
+        self.names = [str_table.get(int(symbols.st_name[i])) for i in rows]
+        starts = [int(symbols.st_value[i]) for i in rows]
+        ends = [start + int(symbols.st_size[i]) for start, i in zip(starts, rows)]
+        distinct = sorted(set(starts))
+        for k, i in enumerate(rows):
+            if ends[k] == starts[k]:
+                j = bisect_right(distinct, starts[k])
+                end = distinct[j] if j < len(distinct) else None
+                shndx = int(symbols.st_shndx[i])
+                if shndx < len(sections):
+                    section = sections[shndx]
+                    if section.sh_addr <= starts[k] < section.sh_addr + section.sh_size:
+                        end = min(end or section.sh_addr + section.sh_size, section.sh_addr + section.sh_size)
+                ends[k] = end if end is not None else starts[k] + 1
+        self.symbol_starts = starts
+        self.build_segments(starts, ends)
+
+    def build_segments(self, starts: list, ends: list) -> None:
+        order = sorted(range(len(starts)), key=lambda k: (starts[k], ends[k]))
+        segment_starts, segment_ends, segment_symbols = [], [], []
+        if all(ends[a] <= starts[b] for a, b in zip(order, order[1:])):
+            # Без пересечений отрезки - сами символы
+            for k in order:
+                segment_starts.append(starts[k])
+                segment_ends.append(ends[k])
+                segment_symbols.append(k)
         else:
-            if int(rs1, 2) == 0 and int(rs2, 2) == 0:
-                return "c.ebreak"
-            elif int(rs2, 2) == 0:
-                return "{0} {1}".format("c.jalr", ABI_REGS[int(rs1, 2)])
-            elif int(rs1, 2) != 0 and int(rs2, 2) != 0:
-                return "{0} {1}, {2}".format("c.add", ABI_REGS[int(rs1, 2)], ABI_REGS[int(rs2, 2)])
-        return "unknown_command"
-
-
-    def parseSWDSP2(cmd: str, command: str) -> str:
-        rs2 = cmd[-7:-2]
-        if command == "c.swsp":
-            imm = cmd[-9:-7] + cmd[-13:-9] + 2 * "0"
+            # Проход по границам с кучей активных символов, сверху - с наибольшим началом
+            bounds = sorted(set(starts) | set(ends))
+            active = []
+            position = 0
+            for bound, following in zip(bounds, bounds[1:]):
+                while position < len(order) and starts[order[position]] <= bound:
+                    k = order[position]
+                    heapq.heappush(active, (-starts[k], ends[k], k))
+                    position += 1
+                while active and active[0][1] <= bound:
+                    heapq.heappop(active)
+                if not active:
+                    continue
+                k = active[0][2]
+                if segment_symbols and segment_symbols[-1] == k and segment_ends[-1] == bound:
+                    segment_ends[-1] = following
+                else:
+                    segment_starts.append(bound)
+                    segment_ends.append(following)
+                    segment_symbols.append(k)
+        if np is not None:
+            self.segment_starts = np.array(segment_starts, dtype=np.uint64)
+            self.segment_ends = np.array(segment_ends, dtype=np.uint64)
+            self.segment_symbols = np.array(segment_symbols, dtype=np.int64)
+            # Начало символа каждого отрезка, чтобы смещение считалось без второй выборки по индексам
+            self.segment_bases = np.array([self.symbol_starts[k] for k in segment_symbols], dtype=np.uint64)
+        else:
+            self.segment_starts, self.segment_ends, self.segment_symbols = segment_starts, segment_ends, segment_symbols
+
+    def __len__(self) -> int:
+        return len(self.segment_starts)
+
+    def lookup(self, addresses) -> tuple:
+        # (номера символов, смещения) для массива адресов; -1 - адрес вне символов.
+        # Номер символа - индекс в names, rows (строка .symtab) и symbol_starts
+        if np is None:
+            symbols, offsets = array("q"), array("Q")
+            for address in addresses:
+                i = bisect_right(self.segment_starts, address) - 1
+                if i >= 0 and address < self.segment_ends[i]:
+                    symbols.append(self.segment_symbols[i])
+                    offsets.append(address - self.symbol_starts[self.segment_symbols[i]])
+                else:
+                    symbols.append(-1)
+                    offsets.append(0)
+            return symbols, offsets
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        if not len(self.segment_starts):
+            return np.full(len(addresses), -1, dtype=np.int64), np.zeros(len(addresses), dtype=np.uint64)
+        if len(self.segment_starts) >= SYMBOLIZER_SORT_MIN:
+            # По большому индексу searchsorted намного быстрее на упорядоченных ключах: адреса сортируются,
+            # а найденные номера отрезков раскладываются обратно по исходным позициям
+            order = np.argsort(addresses, kind="stable")
+            i = np.empty(len(addresses), dtype=np.int64)
+            i[order] = np.searchsorted(self.segment_starts, addresses[order], side="right")
         else:
-            imm = cmd[-10:-7] + cmd[-13:-10] + 2 * "0"
-        return "{0} {1}, {2}(sp)".format(command, ABI_REGS[int(rs2, 2)], int(imm, 2))
+            i = np.searchsorted(self.segment_starts, addresses, side="right")
+        i -= 1
+        # Адрес до первого отрезка попадает в отрезок 0 и отсеивается сравнением с его началом
+        np.maximum(i, 0, out=i)
+        missed = (addresses < self.segment_starts[i]) | (addresses >= self.segment_ends[i])
+        symbols = self.segment_symbols[i]
+        offsets = addresses - self.segment_bases[i]
+        symbols[missed] = -1
+        offsets[missed] = 0
+        return symbols, offsets
+
+    def symbolize(self, addresses) -> list:
+        # "имя" или "имя+0x1c" для каждого адреса, None - адрес вне символов
+        symbols, offsets = self.lookup(addresses)
+        names = self.names
+        return [None if symbol < 0 else names[symbol] if not offset else "{0}+0x{1:x}".format(names[symbol], offset)
+                for symbol, offset in zip(symbols.tolist(), offsets.tolist())]
+
+
+class ElfFile:
+    # Разобранный ELF для использования из кода. Данные, порядок байт и класс хранятся в объекте
+    # и передаются во все разборы, поэтому одновременно можно держать открытыми несколько файлов.
+    # Дизассемблируются все исполняемые секции (code_sections), метки общие для всех секций.
+
+    def __init__(self, data, rvc_table=None, stats: RunStats = None, symbol_query: SymbolQuery = None) -> None:
+        self.stats = stats
+        self.symbol_query = symbol_query
+        started = perf_counter()
+        self.data = memoryview(data).cast("B")
+        self.byte_order, self.elf_class = elf_layout(self.data)
+        self.xlen = ELF_XLEN[self.elf_class]
+        self.header = Header(self.data)
+        self.sections = []
+        self.string_tables = {}
+        self.section_index = parse_sections(self.data, self.header, self.sections, self.string_tables)
+        self.strtab = get_string_table(self.data, getSectionByName(self.section_index, ".strtab"), self.string_tables)
+        self.symtab = getSectionByName(self.section_index, ".symtab")
+        self.code_sections = self.section_index.code()
+        text = self.section_index.by_name.get(".text")
+        self.code = text if text in self.code_sections else self.code_sections[0]
+        self.code_size = sum(section.sh_size for section in self.code_sections)
+        if stats is not None:
+            started = stats.stage("sections", started)
+        self.symbols = parse_symbol_table_rows(self.data, self.symtab, self.byte_order, self.elf_class)
+        if stats is not None:
+            stats.stage("symtab", started)
+        self.decode4BitCMD, self.decode2BitCMD = get_decoders(self.xlen, rvc_table)
+        self.indexes = {}
+        self.labels_formated = None
+        self.symbolizer_index = None
+
+    @classmethod
+    def open(cls, path: str, rvc_table=None, stats: RunStats = None, symbol_query: SymbolQuery = None) -> "ElfFile":
+        return cls(map_file(path), rvc_table, stats, symbol_query)
+
+    def section_bytes(self, section: Section):
+        return self.data[section.sh_offset:section.sh_offset + section.sh_size]
+
+    def section_at(self, address: int) -> Section:
+        for section in self.code_sections:
+            if section.sh_addr <= address < section.sh_addr + section.sh_size:
+                return section
+        return None
+
+    def instruction_index(self, section: Section = None) -> tuple:
+        # (смещения, длины, слова) всех команд секции (по умолчанию .text), строится один раз по требованию
+        section = self.code if section is None else section
+        index = self.indexes.get(section.sh_offset)
+        if index is None:
+            code_bytes = self.section_bytes(section)
+            offsets, sizes = build_instruction_index(code_bytes)
+            index = self.indexes[section.sh_offset] = offsets, sizes, instruction_words(code_bytes, offsets, sizes)
+        return index
+
+    def windows(self, start: int = None, end: int = None, window: int = LISTING_WINDOW):
+        # (секция, начало, смещения, длины, слова) по окнам code_windows для адресов [start, end) каждой
+        # секции кода (по умолчанию - всего кода); целая небольшая секция - одно окно с общим индексом
+        if start is None and end is None:
+            ranges = [(section, 0, section.sh_size) for section in self.code_sections]
+        else:
+            ranges = self.code_ranges(start, end)
+        for section, begin, finish in ranges:
+            if begin == 0 and finish == section.sh_size and section.sh_size <= window:
+                yield (section, 0) + self.instruction_index(section)
+                continue
+            code_bytes = self.section_bytes(section)[begin:finish]
+            for window_begin, window_end, offsets, sizes in code_windows(code_bytes, window):
+                yield (section, begin + window_begin, offsets, sizes,
+                       instruction_words(code_bytes[window_begin:window_end], offsets, sizes))
+
+    def window_records(self, section: Section, begin: int, offsets, sizes, words, stats: RunStats = None) -> list:
+        return decode_window(section.sh_addr + begin, offsets, sizes, words, self.decode2BitCMD, self.decode4BitCMD,
+                             stats, self.xlen)
+
+    def records(self, start: int = None, end: int = None) -> list:
+        records = []
+        for window in self.windows(start, end):
+            records += self.window_records(*window)
+        return records
+
+    def labels(self, targets=None) -> LabelsFormated:
+        # targets - уже известные адреса целей переходов; если не заданы, собираются по всем секциям кода
+        if self.labels_formated is None:
+            labels = LabelsFormated(self.symbols, self.strtab)
+            if targets is None:
+                targets = (target for window in self.windows() for target in self.window_targets(*window))
+            for target in targets:
+                # Генерируем метку новую, если это конечно имеет смысл
+                labels.add_unnamed_label(target)
+            labels.build_index()
+            labels.countMaxLen()
+            self.labels_formated = labels
+        return self.labels_formated
+
+    def window_targets(self, section: Section, begin: int, offsets, sizes, words):
+        if np is not None:
+            return batch_label_targets(words, sizes, offsets + (section.sh_addr + begin), self.xlen).tolist()
+        return (record[4] for record in self.window_records(section, begin, offsets, sizes, words)
+                if record[4] is not None)
+
+    def symbol_range(self, name: str) -> tuple:
+        # [начало, конец) функции по .symtab; для символа без размера - до следующей функции или конца секции
+        functions = self.symbols.indices_of_type(STT_FUNC)
+        for i in functions:
+            if self.strtab.get(int(self.symbols.st_name[i])) == name:
+                start = int(self.symbols.st_value[i])
+                if self.symbols.st_size[i]:
+                    return start, start + int(self.symbols.st_size[i])
+                section = self.section_at(start)
+                following = [int(self.symbols.st_value[j]) for j in functions if self.symbols.st_value[j] > start]
+                return start, min(following + ([section.sh_addr + section.sh_size] if section is not None else []),
+                                  default=start)
+        raise ValueError("Symbol {0} not found".format(name))
+
+    def code_ranges(self, start: int = None, end: int = None) -> list:
+        # Адреса [start, end) в куски секций кода: (секция, начало, конец) со смещениями внутри секции
+        ranges = []
+        for section in self.code_sections:
+            begin = 0 if start is None else min(max(start - section.sh_addr, 0), section.sh_size)
+            finish = section.sh_size if end is None else min(max(end - section.sh_addr, begin), section.sh_size)
+            if begin < finish:
+                ranges.append((section, begin, finish))
+        return ranges
+
+    def instructions(self, start: int = None, end: int = None):
+        # Декодируются только байты [start, end), по окнам INSTRUCTION_STREAM_WINDOW байт - потребитель,
+        # остановившийся раньше, платит только за дошедшие до него окна. Для всего файла метки целей требуют
+        # знать все переходы, поэтому они собираются при первой команде с целью; в диапазоне - relative_label.
+        scoped = start is not None or end is not None
+        labels = LabelsFormated(self.symbols, self.strtab) if scoped else None
+        for window in self.windows(start, end, INSTRUCTION_STREAM_WINDOW):
+            for (address, size, mnemonic_id, operands, target), word in zip(self.window_records(*window),
+                                                                              window[4].tolist()):
+                target_label = None
+                if target is not None:
+                    if labels is None:
+                        labels = self.labels()
+                    target_label = labels.relative_label(target) if scoped else labels.get_label(target)
+                    # Форматтер оставляет после регистров разделитель перед меткой цели - в operands он не нужен
+                    if operands.endswith(TARGET_SEPARATOR):
+                        operands = operands[:-len(TARGET_SEPARATOR)]
+                yield Instruction(address, size, word, MNEMONICS[mnemonic_id], operands, target, target_label)
+
+    def listing_lines(self, start: int = None, end: int = None):
+        if start is not None or end is not None:
+            yield from self.scoped_listing_lines(start, end)
+            return
+        stats = self.stats
+        started = perf_counter()
+        decoded = None
+        if self.code_size <= LISTING_WINDOW:
+            # Весь код в одном окне на секцию: записи декодируются один раз и для меток, и для вывода
+            decoded = [window + (self.window_records(*window, stats=stats),) for window in self.windows()]
+            if stats is not None:
+                started = stats.stage("decode", started)
+            if np is None:
+                # Цели переходов уже есть в записях, второй проход по секциям не нужен
+                self.labels(record[4] for window in decoded for record in window[5] if record[4] is not None)
+        labels = self.labels()
+        if stats is not None:
+            stats.count_labels(labels)
+            started = stats.stage("labels", started)
+        current = None
+        for window in decoded if decoded is not None else self.windows():
+            if window[0] is not current:
+                yield section_title(window[0], current is None)
+                current = window[0]
+            window_records = window[5] if decoded is not None else self.window_records(*window, stats=stats)
+            if stats is not None:
+                started = stats.stage("decode", started)
+            for record in window_records:
+                yield format_listing_line(record, labels)
+            if stats is not None:
+                started = stats.stage("output", started)
+        yield from self.symtab_lines()
+
+    def scoped_listing_lines(self, start: int, end: int):
+        # Листинг части кода без таблицы символов, по заголовку на каждую затронутую секцию
+        stats = self.stats
+        started = perf_counter()
+        pieces = [(window[0], self.window_records(*window, stats=stats)) for window in self.windows(start, end)]
+        if stats is not None:
+            started = stats.stage("decode", started)
+        labels = LabelsFormated(self.symbols, self.strtab)
+        for section, records in pieces:
+            for record in records:
+                if record[4] is not None:
+                    labels.add_unnamed_label(record[4])
+        labels.build_index(relative=True)
+        labels.countMaxLen()
+        if stats is not None:
+            stats.count_labels(labels)
+            started = stats.stage("labels", started)
+        current = None
+        for section, records in pieces:
+            if section is not current:
+                yield section_title(section, current is None)
+                current = section
+            for record in records:
+                yield format_listing_line(record, labels)
+        if stats is not None:
+            stats.stage("output", started)
+
+    def columns(self, start: int = None, end: int = None) -> dict:
+        # Колонки для write_columns: те же команды, метки и .symtab, что и в текстовом листинге
+        stats = self.stats
+        started = perf_counter()
+        scoped = start is not None or end is not None
+        pool = StringPool(MNEMONICS)
+        add = pool.add
+        parts = {name: [] for name in ("address", "length", "word", "mnemonic", "target_offset")}
+        targets = []
+        for section, begin, offsets, sizes, words in self.windows(start, end):
+            records = self.window_records(section, begin, offsets, sizes, words, stats)
+            parts["address"].append(array("Q", (record[0] for record in records)))
+            parts["length"].append(sizes)
+            parts["word"].append(words)
+            parts["mnemonic"].append(array("H", (record[2] for record in records)))
+            parts["target_offset"].append(array("i", (COLUMNAR_NO_TARGET if record[4] is None
+                                                      else record[4] - record[0] for record in records)))
+            if scoped or np is None:
+                targets += [record[4] for record in records if record[4] is not None]
+        if stats is not None:
+            started = stats.stage("decode", started)
+        if scoped:
+            labels = LabelsFormated(self.symbols, self.strtab)
+            for target in targets:
+                labels.add_unnamed_label(target)
+            labels.build_index(relative=True)
+        else:
+            labels = self.labels(targets if np is None else None)
+        if stats is not None:
+            stats.count_labels(labels)
+            started = stats.stage("labels", started)
+        columns = {}
+        for name, items in parts.items():
+            if np is not None:
+                columns[name] = np.concatenate([np.asarray(item) for item in items]) if items else []
+            else:
+                columns[name] = array(COLUMNAR_TYPECODES[dict(COLUMNAR_COLUMNS)[name]])
+                for item in items:
+                    columns[name].extend(item)
+        if np is not None:
+            columns.update(batch_operand_fields(columns["mnemonic"], columns["word"], self.xlen))
+        else:
+            fields = [operand_fields(mnemonic_id, word, self.xlen)
+                      for mnemonic_id, word in zip(columns["mnemonic"], columns["word"])]
+            for i, name in enumerate(OPERAND_FIELD_NAMES + ("funct3", "funct7")):
+                columns[name] = array(COLUMNAR_TYPECODES[dict(COLUMNAR_COLUMNS)[name]], (row[i] for row in fields))
+        label_addresses = sorted(labels.labels_human)
+        columns["label_address"] = array("q", label_addresses)
+        columns["label_name"] = array("I", (add(labels.labels_human[address]) for address in label_addresses))
+        columns["section_name"] = array("I", (add(section.name) for section in self.code_sections))
+        columns["section_address"] = array("Q", (section.sh_addr for section in self.code_sections))
+        columns["section_size"] = array("Q", (section.sh_size for section in self.code_sections))
+        # Строки .symtab - те же, что в текстовом выводе (symbol_query)
+        indices = self.symbol_indices()
+        for name in ("st_name", "st_value", "st_size", "st_type", "st_bind", "st_vis", "st_shndx"):
+            column = getattr(self.symbols, name)
+            columns[name] = take(column, indices) if indices is not None else column
+        # Имена символов - из смещений в .strtab в номера строк пула, каждое смещение разбирается один раз
+        names = {}
+        columns["st_name"] = array("I", (names[offset] if offset in names else
+                                         names.setdefault(offset, add(self.strtab.get(offset)))
+                                         for offset in columns["st_name"].tolist()))
+        columns["pool_offsets"], columns["pool"] = pool.columns()
+        if stats is not None:
+            stats.stage("columns", started)
+        return columns
+
+    def symbolizer(self) -> Symbolizer:
+        if self.symbolizer_index is None:
+            self.symbolizer_index = Symbolizer(self.symbols, self.strtab, self.sections)
+        return self.symbolizer_index
+
+    def symbol_indices(self):
+        # Строки .symtab для вывода; None - все по порядку
+        if self.symbol_query is None:
+            return None
+        return self.symbol_query.select(self.symbols, self.strtab)
+
+    def symtab_lines(self):
+        started = perf_counter()
+        yield "\n.symtab\n"
+        yield "Symbol Value              Size Type     Bind     Vis       Index Name\n"
+        yield from format_symbol_table(self.symbols, self.strtab, self.symbol_indices())
+        if self.stats is not None:
+            self.stats.stage("symtab_print", started)
+
+
+def open_elf(source, rvc_table=None, stats: RunStats = None, symbol_query: SymbolQuery = None) -> ElfFile:
+    # source - путь к файлу или байты/буфер с содержимым ELF
+    if isinstance(source, (str, os.PathLike)):
+        return ElfFile.open(source, rvc_table, stats, symbol_query)
+    return ElfFile(source, rvc_table, stats, symbol_query)
+
+
+# Запись файлов целиком через временный файл рядом и os.replace: читатель видит либо старый файл, либо новый
+@contextmanager
+def atomic_file(path: str, buffering: int = -1):
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, "wb", buffering=buffering) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    with atomic_file(path) as f:
+        f.write(data)
+
+
+# Файлы marshal с заголовком: магия, версия формата и marshal.version (<II). Файл другой версии
+# или повреждённый читается как None
+# Заголовок файла: magic, версия формата, версия marshal и tool_version() - файл, записанный другой версией
+# дизассемблера, не читается и пересоздаётся
+def versioned_header(magic: bytes, version: int) -> bytes:
+    return magic + struct.pack("<II", version, marshal.version) + tool_version()
 
 
-    def parse2BitCMD(cmd: str, address: int, labels: LabelsFormated):
-        funct1 = cmd[-2:]
-        funct2 = cmd[:3]
+def save_versioned(path: str, magic: bytes, version: int, value) -> None:
+    atomic_write(path, versioned_header(magic, version) + marshal.dumps(value))
 
-        if funct1 == "00":
-            if funct2 == "000":
-                return parseAddi4Spn(cmd)
-            elif funct2 == "010":
-                return parseLW2b(cmd)
-            elif funct2 == "110":
-                return parseSW2b(cmd)
+
+def load_versioned(path: str, magic: bytes, version: int):
+    header = versioned_header(magic, version)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(header)] != header:
+            return None
+        return marshal.loads(data[len(header):])
+    except (OSError, ValueError, EOFError, TypeError, struct.error):
+        return None
+
+
+# Таблица декодирования всех 2^16 сжатых команд.
+# На диске хранится как пул строк и три массива индексов (мнемоника, операнды, смещение).
+def build_rvc_table() -> list:
+    return [parse2BitCMD(cmd) for cmd in range(1 << 16)]
+
+
+def save_rvc_table(table: list, path: str) -> None:
+    strings = {}
+    mnemonics = array("I")
+    operands = array("I")
+    offsets = array("i")
+    for mnemonic, operand, offset in table:
+        mnemonics.append(strings.setdefault(mnemonic, len(strings)))
+        operands.append(strings.setdefault(operand, len(strings)))
+        offsets.append(RVC_TABLE_NO_TARGET if offset is None else offset)
+    save_versioned(path, RVC_TABLE_MAGIC, RVC_TABLE_VERSION,
+                   (tuple(strings), mnemonics.tobytes(), operands.tobytes(), offsets.tobytes()))
+
+
+def load_rvc_table(path: str):
+    value = load_versioned(path, RVC_TABLE_MAGIC, RVC_TABLE_VERSION)
+    if not isinstance(value, tuple) or len(value) != 4:
+        return None
+    strings, mnemonics, operands, offsets = value
+    mnemonics, operands, offsets = array("I", mnemonics), array("I", operands), array("i", offsets)
+    if not len(mnemonics) == len(operands) == len(offsets) == 1 << 16:
+        return None
+    table = []
+    for mnemonic, operand, offset in zip(mnemonics, operands, offsets):
+        command = (strings[mnemonic], strings[operand], None if offset == RVC_TABLE_NO_TARGET else offset)
+        table.append(UNKNOWN_COMMAND if command == UNKNOWN_COMMAND else command)
+    return table
+
+
+def get_rvc_table(path: str) -> list:
+    table = load_rvc_table(path)
+    if table is None:
+        table = build_rvc_table()
+        try:
+            save_rvc_table(table, path)
+        except OSError:
+            pass
+    return table
+
+
+@lru_cache(maxsize=None)
+def tool_version() -> bytes:
+    # Отпечаток исходника дизассемблера: любое изменение кода делает старые записи кэша недействительными
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def listing_key(elf: "ElfFile", scope: tuple = None, output_format: str = "text") -> str:
+    head = elf.header
+    key = hashlib.sha256(tool_version())
+    if scope is not None:
+        key.update("{0}:{1}".format(*scope).encode())
+    if output_format != "text":
+        key.update(output_format.encode())
+    if elf.symbol_query is not None:
+        key.update(elf.symbol_query.key().encode())
+    key.update(elf.data[:head.e_ehsize])
+    key.update(elf.data[head.e_shoff:head.e_shoff + head.e_shnum * head.e_shentsize])
+    for section in [elf.sections[head.e_shstrndx], elf.symtab, elf.section_index.get(".strtab")] + elf.code_sections:
+        key.update(elf.data[section.sh_offset:section.sh_offset + section.sh_size])
+    return key.hexdigest()
+
+
+class ListingCache:
+    # Кэш готовых листингов по хэшу содержимого. Запись атомарна (os.replace), время доступа - mtime файла,
+    # при превышении размера удаляются давно не использованные записи.
+    # Каталог обходится только когда известный этому кэшу размер записей (sizes: путь -> размер) превысил
+    # max_size, очистка оставляет не больше LISTING_CACHE_TRIM от max_size, чтобы следующие записи не обходили его
+    # снова. Расширение записи - расширение формата вывода (OUTPUT_EXTENSIONS); рядом с листингом --incremental
+    # лежит его состояние IncrementalState с расширением .state
+
+    def __init__(self, directory: str, max_size: int = LISTING_CACHE_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.sizes = None
+        self.tracked_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def path(self, key: str, output_format: str = "text") -> str:
+        return os.path.join(self.directory, key[:2], key + CACHE_EXTENSIONS[output_format])
+
+    def fetch(self, key: str, output_path: str, output_format: str = "text") -> bool:
+        path = self.path(key, output_format)
+        try:
+            os.utime(path)
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            # Записи нет или её только что удалил evict() другого процесса
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, listing_path: str, output_format: str = "text") -> None:
+        path = self.path(key, output_format)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(listing_path, "rb") as listing, atomic_file(path) as entry:
+                shutil.copyfileobj(listing, entry)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if self.sizes is None:
+            self.track(self.entries())
+        # Перезапись той же записи заменяет её прежний размер, а не добавляется к нему
+        self.tracked_size += size - self.sizes.get(path, 0)
+        self.sizes[path] = size
+        if self.tracked_size > self.max_size:
+            self.evict()
+
+    def track(self, entries: list) -> None:
+        self.sizes = {path: size for _, size, path in entries}
+        self.tracked_size = sum(self.sizes.values())
+
+    def entries(self) -> list:
+        entries = []
+        extensions = tuple(CACHE_EXTENSIONS.values())
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(extensions):
+                    path = os.path.join(directory, name)
+                    try:
+                        info = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        limit = self.max_size * LISTING_CACHE_TRIM if size > self.max_size else self.max_size
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                # Запись уже удалил параллельный процесс
+                pass
+            size -= entry_size
+            removed += 1
+        # Удаляются самые старые записи, остальные - конец отсортированного списка
+        self.track(entries[removed:])
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def add_stats(self, stats: dict) -> None:
+        self.hits += stats["hits"]
+        self.misses += stats["misses"]
+        self.evicted += stats["evicted"]
+
+    def format_stats(self) -> str:
+        entries = self.entries()
+        return "Cache: hits {0}, misses {1}, evicted {2}, {3} entries, {4} bytes".format(
+            self.hits, self.misses, self.evicted, len(entries), sum(entry[1] for entry in entries))
+
+
+def map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@lru_cache(maxsize=None)
+def get_decode2BitCMD(rvc_table):
+    if rvc_table is not None:
+        return get_rvc_table(rvc_table).__getitem__
+    return cached_parse2BitCMD
+
+
+def get_decoders(xlen: int, rvc_table=None) -> tuple:
+    # (декодер 32-битных команд, декодер сжатых); таблица сжатых команд построена для RV32
+    if xlen == 64:
+        return cached_parse4BitCMD64, cached_parse2BitCMD64
+    return cached_parse4BitCMD, get_decode2BitCMD(rvc_table)
+
+
+# Параллельный режим: секции кода режутся на куски по границам команд (по возможности - по началам функций),
+# воркеры отображают тот же входной файл через mmap и декодируют каждый свой кусок.
+def split_code(code: Section, offsets: list, sym_table_rows: SymbolTableColumns, chunks: int) -> list:
+    size = code.sh_size
+    chunks = min(chunks, size // PARALLEL_MIN_CHUNK)
+    if chunks <= 1:
+        return [(0, size)]
+    starts = set(offsets)
+    functions = sorted(set(int(sym_table_rows.st_value[i]) - code.sh_addr
+                           for i in sym_table_rows.indices_of_type(STT_FUNC)) & starts)
+    step = size // chunks
+    bounds = [0]
+    for k in range(1, chunks):
+        ideal = size * k // chunks
+        cut = None
+        i = bisect_right(functions, ideal)
+        candidates = functions[max(i - 1, 0):i + 1]
+        if candidates:
+            cut = min(candidates, key=lambda offset: abs(offset - ideal))
+            if abs(cut - ideal) > step // 2:
+                cut = None
+        if cut is None:
+            i = bisect_right(offsets, ideal)
+            cut = offsets[i] if i < len(offsets) else size
+        if bounds[-1] < cut < size:
+            bounds.append(cut)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def split_sections(elf: "ElfFile", chunks: int) -> list:
+    # Куски всех секций кода: (секция, начало, конец). Число кусков делится между секциями по размеру,
+    # небольшие секции идут одним куском и декодируются параллельно с остальными
+    result = []
+    for section in elf.code_sections:
+        section_chunks = max(chunks * section.sh_size // max(elf.code_size, 1), 1)
+        if section.sh_size <= LISTING_WINDOW:
+            bounds = split_code(section, elf.instruction_index(section)[0].tolist(), elf.symbols, section_chunks)
+        else:
+            # Большая секция режется по окнам без полного индекса команд
+            window = max(min(LISTING_WINDOW, section.sh_size // section_chunks) & ~1, 4)
+            bounds = [(begin, end) for begin, end, offsets, sizes in code_windows(elf.section_bytes(section), window)]
+        result += [(section, begin, end) for begin, end in bounds]
+    return result
+
+
+worker_state = {}
+
+
+def init_worker(path: str, rvc_table, xlen: int, labels, count: bool = False) -> None:
+    # count - считать команды для RunStats родителя: format_chunk тогда возвращает ещё и счётчики куска
+    worker_state["data"] = memoryview(map_file(path)).cast("B")
+    worker_state["decode4BitCMD"], worker_state["decode2BitCMD"] = get_decoders(xlen, rvc_table)
+    worker_state["xlen"] = xlen
+    worker_state["labels"] = labels
+    worker_state["count"] = count
+
+
+def decode_chunk(bounds: tuple, stats: RunStats = None) -> list:
+    # bounds - (смещение секции в файле, адрес секции, начало и конец куска внутри секции)
+    code_offset, code_address, start, end = bounds
+    chunk = worker_state["data"][code_offset + start:code_offset + end]
+    records = []
+    for begin, finish, offsets, sizes in code_windows(chunk):
+        records += decode_window(code_address + start + begin, offsets, sizes,
+                                 instruction_words(chunk[begin:finish], offsets, sizes),
+                                 worker_state["decode2BitCMD"], worker_state["decode4BitCMD"], stats,
+                                 worker_state["xlen"])
+    return records
+
+
+def collect_chunk_targets(bounds: tuple) -> list:
+    return [record[4] for record in decode_chunk(bounds) if record[4] is not None]
+
+
+def format_chunk(bounds: tuple) -> tuple:
+    # (текст куска, счётчики RunStats.as_dict() или None)
+    labels = worker_state["labels"]
+    stats = RunStats() if worker_state["count"] else None
+    text = "".join(format_listing_line(record, labels) for record in decode_chunk(bounds, stats))
+    return text, stats.as_dict() if stats is not None else None
+
+
+def run_parallel(jobs: int, func, chunks: list, initargs: tuple):
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=initargs) as pool:
+        for result in pool.imap(func, chunks):
+            yield result
+
+
+class DisassemblerError(Exception):
+    def __init__(self, message: str, code: int) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def chunk_texts(results, stats: RunStats):
+    # Тексты кусков из format_chunk; счётчики воркеров добавляются в stats
+    for text, chunk_stats in results:
+        if chunk_stats is not None:
+            stats.add(chunk_stats)
+        yield text
+
+
+def titled_chunks(chunks: list, texts):
+    # Заголовок секции перед её первым куском
+    current = None
+    for (section, start, end), text in zip(chunks, texts):
+        if section is not current:
+            yield section_title(section, current is None)
+            current = section
+        yield text
+
+
+def write_parallel_listing(writer: ListingWriter, elf: ElfFile, input_path: str, rvc_table, chunks: list,
+                           jobs: int) -> None:
+    stats = elf.stats
+    started = perf_counter()
+    initargs = (input_path, rvc_table, elf.xlen, None)
+    bounds = [(section.sh_offset, section.sh_addr, start, end) for section, start, end in chunks]
+    if np is not None:
+        labels = elf.labels()
+    else:
+        labels = elf.labels(target for chunk_targets in run_parallel(jobs, collect_chunk_targets, bounds, initargs)
+                            for target in chunk_targets)
+    if stats is not None:
+        stats.count_labels(labels)
+        started = stats.stage("labels", started)
+    # Куски возвращаются в исходном порядке, поэтому листинг совпадает с последовательным
+    texts = chunk_texts(run_parallel(jobs, format_chunk, bounds, initargs[:3] + (labels, stats is not None)), stats)
+    writer.write_lines(titled_chunks(chunks, texts))
+    if stats is not None:
+        stats.stage("decode_and_output", started)
+    writer.write_lines(elf.symtab_lines())
+
+
+# Инкрементальный режим: код режется на куски по началам функций (длинные функции - ещё и через
+# INCREMENTAL_CHUNK байт от начала функции), для каждого куска сохраняются хэш байтов, смещения целей переходов,
+# подпись использованных им меток и место его текста в листинге. При следующем запуске куски с тем же хэшем
+# не декодируются, а если не изменились ещё адрес и подпись меток - их текст копируется из прошлого листинга.
+def chunk_starts(offsets: list, functions: list, max_chunk: int = INCREMENTAL_CHUNK) -> list:
+    # Номера команд, с которых начинаются куски; functions - смещения начал функций по возрастанию
+    starts = [0]
+    for function in functions:
+        i = bisect_left(offsets, function)
+        if i < len(offsets) and offsets[i] == function and i > starts[-1]:
+            starts.append(i)
+    result = []
+    for i, end in zip(starts, starts[1:] + [len(offsets)]):
+        while i < end:
+            result.append(i)
+            i = bisect_left(offsets, offsets[i] + max_chunk, i + 1, end)
+    return result or [0]
+
+
+def chunk_signature(labels: LabelsFormated, start: int, end: int, targets: list) -> bytes:
+    # Метки, которые попадают в текст куска: свои в [start, end) и метки целей переходов
+    i = bisect_left(labels.addresses, start)
+    j = bisect_left(labels.addresses, end)
+    names = ["{0:x}={1}".format(address, labels.labels_human[address]) for address in labels.addresses[i:j]]
+    names += [labels.labels_human.get(target, "") for target in targets]
+    return hashlib.blake2b("\n".join(names).encode(), digest_size=16).digest()
+
+
+class IncrementalState:
+    # Куски прошлого запуска: (адрес, длина, хэш, смещения целей переходов в array("i"), подпись меток,
+    # смещение и длина текста в листинге); listing - (путь, размер, mtime_ns) этого листинга
+
+    def __init__(self, listing: tuple = None, chunks: list = None) -> None:
+        self.listing = listing
+        self.chunks = chunks if chunks is not None else []
+
+    @classmethod
+    def load(cls, path: str, xlen: int) -> "IncrementalState":
+        # Состояние другой версии дизассемблера (см. load_versioned) или другой разрядности не используется
+        value = load_versioned(path, INCREMENTAL_MAGIC, INCREMENTAL_VERSION)
+        if not isinstance(value, tuple) or len(value) != 3:
+            return cls()
+        state_xlen, listing, chunks = value
+        if state_xlen != xlen:
+            return cls()
+        return cls(listing, chunks)
+
+    def save(self, path: str, xlen: int) -> None:
+        save_versioned(path, INCREMENTAL_MAGIC, INCREMENTAL_VERSION, (xlen, self.listing, self.chunks))
+
+    def open_listing(self):
+        # Прошлый листинг, если он не изменился после сохранения состояния
+        if self.listing is None:
+            return None
+        path, size, mtime = self.listing
+        try:
+            info = os.stat(path)
+            if info.st_size != size or info.st_mtime_ns != mtime or not size:
+                return None
+            return map_file(path)
+        except (OSError, ValueError):
+            return None
+
+
+def write_incremental_listing(elf: ElfFile, state_path: str, output_path: str, buffer_size: int) -> None:
+    stats = elf.stats
+    started = perf_counter()
+    previous = IncrementalState.load(state_path, elf.xlen)
+    by_digest = {chunk[2]: chunk for chunk in previous.chunks}
+    by_address = {(chunk[0], chunk[2]): chunk for chunk in previous.chunks}
+    old_listing = previous.open_listing()
+    functions = sorted(set(int(elf.symbols.st_value[i]) for i in elf.symbols.indices_of_type(STT_FUNC)))
+    chunks = []
+    targets = []
+    decoded = 0
+    for window in elf.windows():
+        section, begin, offsets, sizes, words = window
+        offset_list = offsets.tolist()
+        code_bytes = elf.section_bytes(section)
+        base = section.sh_addr + begin
+        size = offset_list[-1] + int(sizes[-1]) if offset_list else 0
+        window_functions = [function - base for function in
+                            functions[bisect_left(functions, base):bisect_left(functions, base + size)]]
+        starts = chunk_starts(offset_list, window_functions)
+        for i, j in zip(starts, starts[1:] + [len(offset_list)]):
+            start = offset_list[i] if i < len(offset_list) else 0
+            end = offset_list[j] if j < len(offset_list) else size
+            digest = hashlib.blake2b(code_bytes[begin + start:begin + end], digest_size=16).digest()
+            entry = by_digest.get(digest)
+            records = None
+            if entry is not None:
+                chunk_targets = [base + start + offset for offset in array("i", entry[3])]
+            else:
+                records = elf.window_records(section, begin, offsets[i:j], sizes[i:j], words[i:j], stats)
+                chunk_targets = [record[4] for record in records if record[4] is not None]
+                decoded += 1
+            targets += chunk_targets
+            chunks.append([section, base + start, base + end, digest, records, chunk_targets, window, i, j])
+    if stats is not None:
+        started = stats.stage("decode", started)
+    labels = elf.labels(targets)
+    if stats is not None:
+        stats.count_labels(labels)
+        started = stats.stage("labels", started)
+
+    encoding = locale.getpreferredencoding(False)
+    state = IncrementalState()
+    copied = 0
+    with atomic_file(output_path, buffer_size) as out:
+        position = 0
+        current = None
+        for section, start, end, digest, records, chunk_targets, window, i, j in chunks:
+            if section is not current:
+                title = section_title(section, current is None).encode(encoding)
+                out.write(title)
+                position += len(title)
+                current = section
+            signature = chunk_signature(labels, start, end, chunk_targets)
+            entry = by_address.get((start, digest))
+            section, begin, offsets, sizes, words = window
+            if old_listing is not None and entry is not None and entry[4] == signature:
+                text = old_listing[entry[5]:entry[5] + entry[6]]
+                copied += 1
+                if stats is not None:
+                    # Скопированный кусок не декодируется, неизвестные команды считаются по его тексту
+                    stats.count_instructions(words[i:j], sizes[i:j], text.count(b"  unknown_command\n"), elf.xlen)
             else:
-                return "unknown_command"
-        elif funct1 == "01":
-            # NOP (хз)
-            if funct2 == "000":
-                return parseADDI2(cmd)
-            elif funct2 == "001":
-                return parseJAL2(cmd, address, labels)
-            elif funct2 == "010":
-                return parseLI2(cmd)
-            elif funct2 == "011":
-                return parseAddi16SpAndLui(cmd)
-            elif funct2 == "100":
-                return parseBlock100(cmd)
-            elif funct2 == "101":
-                return parseJ2(cmd, address, labels)
-            elif funct2 == "110":
-                return parseBEQZBNEZ(cmd, address, labels, "c.beqz")
-            elif funct2 == "111":
-                return parseBEQZBNEZ(cmd, address, labels, "c.bnez")
-        elif funct1 == "10":
-            if funct2 == "000":
-                return parseSLLI2(cmd)
-            elif funct2 == "010":
-                return parseLWSP(cmd)
-            elif funct2 == "100":
-                return parseSys2(cmd, address, labels)
-            elif funct2 == "110":
-                return parseSWDSP2(cmd, "c.swsp")
-            elif funct2 == "111":
-                return parseSWDSP2(cmd, "c.sdsp")
-        return "unknown_command"
-
-
-    parse_sections(head, sections)
-    
-
-    strtab = getSectionByName(head, sections, ".strtab")
-    
-    symtab = getSectionByName(head, sections, ".symtab")
-    
-    code = getSectionByName(head, sections, ".text")
-    
-    
-    parse_symbol_table_rows(symtab, sym_table_rows)
-    
-    labels_formated = LabelsFormated(sym_table_rows, strtab)
-
-    parse_code_blocks(code, code_arr)
-
-    i = code.sh_offset
+                if records is None:
+                    records = elf.window_records(section, begin, offsets[i:j], sizes[i:j], words[i:j], stats)
+                text = "".join(format_listing_line(record, labels) for record in records).encode(encoding)
+            out.write(text)
+            state.chunks.append((start, end - start, digest,
+                                 array("i", (target - start for target in chunk_targets)).tobytes(), signature,
+                                 position, len(text)))
+            position += len(text)
+        if stats is not None:
+            stats.count("chunks", len(chunks))
+            stats.count("chunks_decoded", decoded)
+            stats.count("chunks_copied", copied)
+            stats.stage("output", started)
+        for line in elf.symtab_lines():
+            out.write(line.encode(encoding))
+        if old_listing is not None:
+            # Прошлый листинг может лежать по тому же пути, его отображение закрывается до os.replace
+            old_listing.close()
+    info = os.stat(output_path)
+    state.listing = (os.path.abspath(output_path), info.st_size, info.st_mtime_ns)
+    state.save(state_path, elf.xlen)
+
+
+def refresh_incremental_state(elf: ElfFile, cache: ListingCache, key: str, state_path: str, output_path: str,
+                              buffer_size: int) -> None:
+    # Листинг взят из кэша: состояние для него - сохранённое в кэше рядом с ним, с путём и временем нового файла.
+    # Если состояния в кэше нет (запись сделана без --incremental), листинг пересобирается с состоянием
+    path = cache.path(key, "state")
+    state = IncrementalState.load(path, elf.xlen)
+    if state.listing is not None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Запись уже удалил evict() другого процесса, прочитанное состояние от этого не портится
+            pass
+        info = os.stat(output_path)
+        state.listing = (os.path.abspath(output_path), info.st_size, info.st_mtime_ns)
+        state.save(state_path, elf.xlen)
+        return
+    write_incremental_listing(elf, state_path, output_path, buffer_size)
+    cache.store(key, state_path, "state")
+
+
+def disassemble(input_path: str, output_path: str, rvc_table=None, buffer_size: int = OUTPUT_BUFFER_SIZE,
+                in_memory: bool = False, jobs: int = 1, cache: ListingCache = None, symbol: str = None,
+                address_range: tuple = None, stats: RunStats = None, output_format: str = "text",
+                incremental: str = None, symbol_query: SymbolQuery = None) -> None:
+    try:
+        data = map_file(input_path)
+    except Exception:
+        raise DisassemblerError("Error while working with input file.", 404)
+    elf = ElfFile(data, rvc_table, stats, symbol_query)
+    scope = elf.symbol_range(symbol) if symbol is not None else address_range
+    if scope is not None and not elf.code_ranges(*scope):
+        raise DisassemblerError("Range {0:#x}:{1:#x} does not overlap any code section.".format(*scope), 403)
+
+    if in_memory:
+        buffer_size = estimate_listing_size(elf.code_size, len(elf.symbols))
+    incremental = incremental if scope is None and output_format == "text" else None
+    if cache is not None:
+        started = perf_counter()
+        key = listing_key(elf, scope, output_format)
+        try:
+            hit = cache.fetch(key, output_path, output_format)
+        except OSError:
+            raise DisassemblerError("Error while working with output file.", 404)
+        if stats is not None:
+            stats.stage("cache", started)
+            stats.count("cache_hits", int(hit))
+        if hit:
+            if incremental is not None:
+                try:
+                    refresh_incremental_state(elf, cache, key, incremental, output_path, buffer_size)
+                except OSError:
+                    raise DisassemblerError("Error while working with output file.", 404)
+            if stats is not None:
+                stats.count("bytes_written", os.path.getsize(output_path))
+            return
+
+    if incremental is not None:
+        try:
+            write_incremental_listing(elf, incremental, output_path, buffer_size)
+        except OSError:
+            raise DisassemblerError("Error while working with output file.", 404)
+        if stats is not None:
+            stats.count("bytes_written", os.path.getsize(output_path))
+        if cache is not None:
+            cache.store(key, output_path, output_format)
+            cache.store(key, incremental, "state")
+        return
 
     try:
-        out = open(sys.argv[2], "w")
-        out.write(".text\n")
+        out = open(output_path, "wb" if output_format == "columnar" else "w", buffering=buffer_size)
     except Exception:
-        print("Error while working with output file.")
-        print("Interrupring")
-        exit(404)
+        raise DisassemblerError("Error while working with output file.", 404)
 
-    while True:
-        command = get_bytes(i, 4)
-        address = code.sh_addr + i - code.sh_offset
-        b4cmd = parse4BitCMD(bin(command)[2:].rjust(32, '0'), address, labels_formated)
-        if "unknown_command" in b4cmd:
-            command = get_bytes(i, 2)
-            b2cmd = parse2BitCMD(bin(command)[2:].rjust(16, '0'), address, labels_formated)
-            i += 2
+    try:
+        writer = ListingWriter(out)
+        chunks = []
+        if jobs > 1 and scope is None and output_format == "text":
+            chunks = split_sections(elf, jobs * PARALLEL_CHUNKS_PER_JOB)
+        if output_format == "columnar":
+            # Колонки собираются за один последовательный проход, --jobs не используется
+            write_columns(out, elf.columns(*scope) if scope is not None else elf.columns(), elf.xlen)
+        elif scope is not None:
+            writer.write_lines(elf.listing_lines(*scope))
+        elif len(chunks) > 1:
+            write_parallel_listing(writer, elf, input_path, rvc_table, chunks, jobs)
         else:
-            i += 4
-        if i - code.sh_offset >= code.sh_size:
-            break
-    labels_formated.countMaxLen()
-    i = code.sh_offset
-    while True:
-        command = get_bytes(i, 4)
-        address = code.sh_addr + i - code.sh_offset
-        b4cmd = parse4BitCMD(bin(command)[2:].rjust(32, '0'), address, labels_formated)
-        if "unknown_command" in b4cmd:
-            command = get_bytes(i, 2)
-            b2cmd = parse2BitCMD(bin(command)[2:].rjust(16, '0'), address, labels_formated)
-            out.write(hex(address)[2:].rjust(8, '0') + " ")
-            if (not "unknown_command" in b2cmd):
-                labels_formated.print_label(out, address, 0)
-                out.write(b2cmd)
-            else:
-                labels_formated.print_empty_label(out)
-                out.write("unknown_command")
-            i += 2
+            writer.write_lines(elf.listing_lines())
+    finally:
+        out.close()
+    if stats is not None:
+        stats.count("bytes_written", os.path.getsize(output_path))
+    if cache is not None:
+        cache.store(key, output_path, output_format)
+
+
+# Пакетный режим: много небольших ELF-файлов за один запуск, по файлу на процесс пула
+def batch_inputs(source: str) -> tuple:
+    if os.path.isdir(source):
+        root = source
+        paths = [path for path in glob.glob(os.path.join(glob.escape(source), "**", "*.elf"), recursive=True)
+                 if os.path.isfile(path)]
+    else:
+        if glob.has_magic(source):
+            paths = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
         else:
-            out.write(hex(address)[2:].rjust(8, '0') + " ")
-            labels_formated.print_label(out, address, 0)
-            out.write(b4cmd)
-            i += 4
-        out.write("\n")
+            # Манифест: по пути на строку, относительные пути считаются от каталога манифеста
+            base = os.path.dirname(source)
+            with open(source) as manifest:
+                paths = [os.path.join(base, line.strip()) for line in manifest
+                         if line.strip() and not line.startswith("#")]
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else ""
+    return root, sorted(paths)
+
+
+def batch_output_path(output_dir: str, root: str, input_path: str, extension: str = ".txt") -> str:
+    relative = os.path.relpath(os.path.abspath(input_path), os.path.abspath(root))
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def disassemble_batch_item(item: tuple) -> tuple:
+    input_path, output_path, options = item
+    if options.get("cache") is not None:
+        # Свежий экземпляр на каждый файл, чтобы счётчики относились только к нему
+        options = dict(options, cache=ListingCache(options["cache"].directory, options["cache"].max_size))
+    if options.get("stats") is not None:
+        options = dict(options, stats=RunStats())
+    cache = options.get("cache")
+    stats = options.get("stats")
+    error = None
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        disassemble(input_path, output_path, **options)
+    except DisassemblerError as e:
+        error = str(e)
+    except Exception as e:
+        error = "Error: {}".format(str(e))
+    return (input_path, output_path, error, cache.stats() if cache is not None else None,
+            stats.as_dict() if stats is not None else None)
+
+
+def disassemble_batch(source: str, output_dir: str, jobs: int, **options) -> int:
+    root, paths = batch_inputs(source)
+    extension = OUTPUT_EXTENSIONS[options.get("output_format", "text")]
+    items = [(path, batch_output_path(output_dir, root, path, extension), options) for path in paths]
+    cache = options.get("cache")
+    stats = options.get("stats")
+    failed = 0
+    with multiprocessing.Pool(min(jobs, len(items)) or 1) as pool:
+        for input_path, output_path, error, cache_stats, run_stats in pool.imap(disassemble_batch_item, items,
+                                                                                chunksize=BATCH_CHUNK_SIZE):
+            if cache_stats is not None:
+                cache.add_stats(cache_stats)
+            if run_stats is not None:
+                # Время этапов складывается по всем файлам, то есть это суммарное процессорное время воркеров
+                stats.add(run_stats)
+            if error is None:
+                print("OK   {0} -> {1}".format(input_path, output_path))
+            else:
+                failed += 1
+                print("FAIL {0}: {1}".format(input_path, error))
+    print("{0} files, {1} failed".format(len(items), failed))
+    return failed
 
-        if i - code.sh_offset >= code.sh_size:
-            break
-    out.write("\n.symtab\n")
-    out.write("Symbol Value              Size Type     Bind     Vis       Index Name\n")
-    for i in range(len(sym_table_rows)):
-        out.write(print_parsed_symbol_table_rows(sym_table_rows[i], strtab, i) + "\n")
-except Exception as e:
-    print("Error while code working")
-    print("Error: {}".format(str(e)))
-    exit(403)
+
+def parse_address_range(value: str) -> tuple:
+    try:
+        start, end = (int(address, 0) for address in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected START:END, got {0}".format(value))
+    if start >= end:
+        raise argparse.ArgumentTypeError("empty range {0}: START must be below END".format(value))
+    return start, end
+
+
+def parse_symbol_values(names: dict):
+    # Тип аргумента для списка через запятую: имена из names (FUNC, GLOBAL, ABS...) или числа
+    codes = {name: value for value, name in names.items()}
+
+    def parse(value: str) -> tuple:
+        try:
+            return tuple(codes[item] if item in codes else int(item, 0) for item in value.upper().split(","))
+        except ValueError:
+            raise argparse.ArgumentTypeError("expected a comma-separated list of {0} or numbers, got {1}".format(
+                "/".join(codes), value))
+    return parse
+
+
+def parse_regex(value: str) -> str:
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise argparse.ArgumentTypeError("bad regular expression {0}: {1}".format(value, e))
+    return value
+
+
+def main() -> None:
+    # -h/--help разбирает argparse, без входного и выходного файлов остаётся прежний код выхода 403
+    if len(sys.argv)<3 and not {"-h", "--help"} & set(sys.argv[1:]):
+        print("Count of args must be 3 or higher")
+        exit(403)
+
+    arg_parser = argparse.ArgumentParser(description="RISC-V ELF disassembler")
+    arg_parser.add_argument("input", help="input ELF file (with --batch: directory, glob or manifest file)")
+    arg_parser.add_argument("output", help="output listing file (with --batch: output directory)")
+    arg_parser.add_argument("--rvc-table", nargs="?", const=RVC_TABLE_PATH, default=None, metavar="PATH",
+                            help="decode compressed commands through a precomputed table cached in PATH "
+                                 "(default: {0})".format(RVC_TABLE_PATH))
+    arg_parser.add_argument("--buffer-size", type=int, default=OUTPUT_BUFFER_SIZE, metavar="BYTES",
+                            help="output buffer size (default: {0})".format(OUTPUT_BUFFER_SIZE))
+    arg_parser.add_argument("--in-memory", action="store_true",
+                            help="collect the listing in an output buffer sized from the input and write it "
+                                 "at once; listings over {0} MB are written in chunks of that size".format(
+                                     IN_MEMORY_BUFFER_LIMIT >> 20))
+    arg_parser.add_argument("--jobs", type=int, default=None, metavar="N",
+                            help="disassemble code sections in N worker processes, with --batch - N files at once "
+                                 "(0 - one per CPU; default: 1, with --batch - one per CPU)")
+    arg_parser.add_argument("--batch", action="store_true",
+                            help="disassemble every .elf file of a directory, glob or manifest "
+                                 "into the output directory")
+    arg_parser.add_argument("--cache", nargs="?", const=LISTING_CACHE_PATH, default=None, metavar="DIR",
+                            help="reuse listings of unchanged files from a cache in DIR "
+                                 "(default: {0})".format(LISTING_CACHE_PATH))
+    arg_parser.add_argument("--cache-size", type=int, default=LISTING_CACHE_SIZE, metavar="BYTES",
+                            help="cache size limit, least recently used listings are evicted "
+                                 "(default: {0})".format(LISTING_CACHE_SIZE))
+    arg_parser.add_argument("--cache-stats", action="store_true", help="print cache hit/miss statistics")
+    arg_parser.add_argument("--stats", nargs="?", const="text", choices=("text", "json"), default=None,
+                            help="print stage timings, instruction, handler and label counts")
+    arg_parser.add_argument("--format", choices=tuple(OUTPUT_EXTENSIONS), default="text", dest="output_format",
+                            help="output format: text listing or binary columnar records for other tools "
+                                 "(see read_columns; default: text)")
+    arg_parser.add_argument("--incremental", metavar="STATE",
+                            help="reuse the decode state saved in STATE by the previous run: only changed code is "
+                                 "decoded and formatted again, then STATE is updated (text listings of whole files)")
+    symtab_group = arg_parser.add_argument_group("symbol table", "filter and sort the .symtab rows of the output")
+    symtab_group.add_argument("--symtab-type", type=parse_symbol_values(SYMBOL_TYPES), metavar="TYPES",
+                              help="only symbols of these types, e.g. FUNC,OBJECT")
+    symtab_group.add_argument("--symtab-bind", type=parse_symbol_values(BIND_TYPES), metavar="BINDS",
+                              help="only symbols with these bindings, e.g. GLOBAL,WEAK")
+    symtab_group.add_argument("--symtab-section", type=parse_symbol_values(SYMBOL_IND), metavar="INDEXES",
+                              help="only symbols of these section indexes, e.g. 1,UNDEF,ABS")
+    symtab_group.add_argument("--symtab-prefix", metavar="PREFIX", help="only symbols whose name starts with PREFIX")
+    symtab_group.add_argument("--symtab-regex", type=parse_regex, metavar="REGEX",
+                              help="only symbols whose name matches REGEX")
+    symtab_group.add_argument("--symtab-sort", choices=("value", "size", "name"),
+                              help="sort the symbol rows (default: .symtab order)")
+    scope_group = arg_parser.add_mutually_exclusive_group()
+    scope_group.add_argument("--symbol", metavar="NAME", help="disassemble only the function NAME from .symtab")
+    scope_group.add_argument("--range", type=parse_address_range, dest="address_range", metavar="START:END",
+                             help="disassemble only addresses [START, END), e.g. 0x10074:0x100a0")
+    args = arg_parser.parse_args()
+    if args.jobs is None:
+        args.jobs = 0 if args.batch else 1
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    cache = ListingCache(args.cache, args.cache_size) if args.cache is not None else None
+    symbol_query = None
+    if any(value is not None for value in (args.symtab_type, args.symtab_bind, args.symtab_section,
+                                           args.symtab_prefix, args.symtab_regex, args.symtab_sort)):
+        symbol_query = SymbolQuery(args.symtab_type, args.symtab_bind, args.symtab_section, args.symtab_prefix,
+                                   args.symtab_regex, args.symtab_sort)
+    options = {"rvc_table": args.rvc_table, "buffer_size": args.buffer_size, "in_memory": args.in_memory,
+               "cache": cache, "symbol": args.symbol, "address_range": args.address_range,
+               "stats": RunStats() if args.stats is not None else None, "output_format": args.output_format,
+               "incremental": args.incremental, "symbol_query": symbol_query}
+    if args.incremental is not None and (args.batch or args.symbol is not None or args.address_range is not None
+                                         or args.output_format != "text"):
+        arg_parser.error("--incremental works only for a text listing of a whole file")
+
+    if args.batch:
+        try:
+            failed = disassemble_batch(args.input, args.output, jobs, **options)
+        except Exception as e:
+            print("Error while code working")
+            print("Error: {}".format(str(e)))
+            exit(403)
+        if args.cache_stats and cache is not None:
+            print(cache.format_stats())
+        if args.stats is not None:
+            print(options["stats"].format(args.stats))
+        if failed:
+            exit(403)
+        return
+
+    try:
+        disassemble(args.input, args.output, jobs=jobs, **options)
+    except DisassemblerError as e:
+        print(e)
+        print("Interrupring")
+        exit(e.code)
+    except Exception as e:
+        print("Error while code working")
+        print("Error: {}".format(str(e)))
+        exit(403)
+    if args.cache_stats and cache is not None:
+        print(cache.format_stats())
+    if args.stats is not None:
+        print(options["stats"].format(args.stats))
+
+
+if __name__ == "__main__":
+    main()
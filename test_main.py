@@ -0,0 +1,134 @@
+import argparse
+import os
+import random
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import benchmark
+import main
+
+
+def build_text_image(*halfwords: int) -> bytes:
+    # Секция .text из заданных полуслов и один символ func_0 в её начале
+    text = struct.pack("<{0}H".format(len(halfwords)), *halfwords)
+    return benchmark.build_elf(text, 1, random.Random(0))
+
+
+def build_text_elf(*halfwords: int) -> main.ElfFile:
+    return main.open_elf(build_text_image(*halfwords))
+
+
+class InstructionOperandsTest(unittest.TestCase):
+    def test_branch_operands_have_no_target_separator(self):
+        # beq a5, zero, +6; c.j 0; c.addi a0, 1
+        beq, c_j, c_addi = build_text_elf(0x8363, 0x0007, 0xa001, 0x0505).instructions()
+        self.assertEqual((beq.mnemonic, beq.operands), ("beq", "a5, zero"))
+        self.assertEqual(beq.target, c_addi.address)
+        self.assertEqual(beq.target_label, "LOC_00001")
+        self.assertEqual((c_addi.mnemonic, c_addi.operands, c_addi.target), ("c.addi", "a0, 1", None))
+
+    def test_compressed_jump_has_empty_operands(self):
+        _, c_j, _ = build_text_elf(0x8363, 0x0007, 0xa001, 0x0505).instructions()
+        self.assertEqual((c_j.mnemonic, c_j.operands), ("c.j", ""))
+        self.assertEqual(c_j.target, c_j.address)
+        self.assertEqual(c_j.target_label, "LOC_00000")
+
+
+class ColumnsOperandsTest(unittest.TestCase):
+    def test_operand_columns_are_numeric(self):
+        columns = build_text_elf(0x8363, 0x0007, 0xa001, 0x0505).columns()
+        no_register = main.COLUMNAR_NO_REGISTER
+        self.assertEqual([main.MNEMONICS[i] for i in columns["mnemonic"]], ["beq", "c.j", "c.addi"])
+        self.assertEqual(list(columns["rd"]), [no_register, no_register, 10])
+        self.assertEqual(list(columns["rs1"]), [15, no_register, 10])
+        self.assertEqual(list(columns["rs2"]), [0, no_register, no_register])
+        self.assertEqual(list(columns["imm"]), [6, 0, 1])
+        self.assertEqual(list(columns["funct3"]), [0, 0b101, 0])
+        self.assertNotIn("operands", columns)
+
+
+class RvcTableTest(unittest.TestCase):
+    def test_table_of_another_tool_version_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rvc_table.bin")
+            with mock.patch.object(main, "tool_version", return_value=bytes(32)):
+                main.save_rvc_table(main.build_rvc_table(), path)
+                self.assertIsNotNone(main.load_rvc_table(path))
+            self.assertIsNone(main.load_rvc_table(path))
+            self.assertEqual(main.get_rvc_table(path), main.build_rvc_table())
+            self.assertIsNotNone(main.load_rvc_table(path))
+
+
+class AddressRangeTest(unittest.TestCase):
+    def test_empty_range_is_rejected(self):
+        self.assertEqual(main.parse_address_range("0x10:0x20"), (0x10, 0x20))
+        for value in ("0x20:0x20", "0x20:0x10"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                main.parse_address_range(value)
+
+    def test_range_outside_code_is_an_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path, output_path = os.path.join(directory, "in.elf"), os.path.join(directory, "out.txt")
+            with open(input_path, "wb") as f:
+                f.write(build_text_image(0x8363, 0x0007, 0xa001, 0x0505))
+            with self.assertRaises(main.DisassemblerError) as error:
+                main.disassemble(input_path, output_path, address_range=(0x10, 0x20))
+            self.assertEqual(error.exception.code, 403)
+            self.assertFalse(os.path.exists(output_path))
+
+
+class ListingCacheTest(unittest.TestCase):
+    def test_overwritten_entry_is_counted_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            listing = os.path.join(directory, "listing.txt")
+            with open(listing, "wb") as f:
+                f.write(b"x" * 100)
+            cache = main.ListingCache(os.path.join(directory, "cache"), max_size=150)
+            for _ in range(3):
+                cache.store("ab" * 32, listing)
+            self.assertEqual(cache.tracked_size, 100)
+            self.assertEqual(cache.evicted, 0)
+            self.assertEqual(main.ListingCache(cache.directory).tracked_size, 0)
+
+    def test_entry_suffix_follows_output_format(self):
+        with tempfile.TemporaryDirectory() as directory:
+            listing = os.path.join(directory, "listing.rvcl")
+            with open(listing, "wb") as f:
+                f.write(b"RVCL")
+            cache = main.ListingCache(os.path.join(directory, "cache"))
+            cache.store("cd" * 32, listing, "columnar")
+            self.assertTrue(os.path.isfile(cache.path("cd" * 32, "columnar")))
+            self.assertTrue(cache.path("cd" * 32, "columnar").endswith(".rvcl"))
+            self.assertEqual(len(cache.entries()), 1)
+            self.assertFalse(cache.fetch("cd" * 32, listing + ".out"))
+            self.assertTrue(cache.fetch("cd" * 32, listing + ".out", "columnar"))
+
+
+class IncrementalCacheTest(unittest.TestCase):
+    def test_cache_hit_updates_incremental_state(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "in.elf")
+            with open(input_path, "wb") as f:
+                f.write(build_text_image(0x8363, 0x0007, 0xa001, 0x0505))
+            cache = main.ListingCache(os.path.join(directory, "cache"))
+            first_state, second_state = os.path.join(directory, "1.state"), os.path.join(directory, "2.state")
+            main.disassemble(input_path, os.path.join(directory, "1.txt"), cache=cache, incremental=first_state)
+            output_path = os.path.join(directory, "2.txt")
+            main.disassemble(input_path, output_path, cache=cache, incremental=second_state)
+            self.assertEqual(cache.hits, 1)
+            state = main.IncrementalState.load(second_state, 32)
+            self.assertEqual(state.listing[0], os.path.abspath(output_path))
+            self.assertEqual(len(state.chunks), len(main.IncrementalState.load(first_state, 32).chunks))
+            self.assertIsNotNone(state.open_listing())
+
+
+class InMemoryBufferTest(unittest.TestCase):
+    def test_buffer_is_capped(self):
+        self.assertEqual(main.estimate_listing_size(1 << 30, 1000), main.IN_MEMORY_BUFFER_LIMIT)
+        self.assertLess(main.estimate_listing_size(1 << 10, 10), main.IN_MEMORY_BUFFER_LIMIT)
+
+
+if __name__ == "__main__":
+    unittest.main()